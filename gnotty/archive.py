@@ -0,0 +1,146 @@
+
+from datetime import date, datetime
+from glob import glob
+from gzip import GzipFile
+from heapq import merge
+from json import dumps, loads
+import os
+from urllib import quote, unquote
+
+from django.conf import settings as django_settings
+from django.utils.timezone import is_aware, make_naive, utc
+
+from gnotty.conf import settings
+from gnotty.models import IRCMessage
+
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+FIELDS = ("id", "nickname", "message", "server", "channel", "join_or_leave",
+          "message_html", "nickname_color")
+
+
+def segment_path(channel, day):
+    """
+    Path to the segment file for a channel's day of messages.
+    """
+    return os.path.join(settings.ARCHIVE_DIR, quote(channel, safe=""),
+                        "%04d" % day.year, "%02d" % day.month,
+                        "%02d.jsonl.gz" % day.day)
+
+
+def archived(channel, day):
+    """
+    Whether the channel's messages for the day have been archived.
+    """
+    return bool(settings.ARCHIVE_DIR) and os.path.exists(
+        segment_path(channel, day))
+
+
+def archived_channels(day):
+    """
+    Channels with messages archived for the day.
+    """
+    if not settings.ARCHIVE_DIR:
+        return []
+    pattern = os.path.join(settings.ARCHIVE_DIR, "*", "%04d" % day.year,
+                           "%02d" % day.month, "%02d.jsonl.gz" % day.day)
+    paths = sorted(glob(pattern))
+    return [unquote(path[len(settings.ARCHIVE_DIR):].lstrip(os.sep)
+                    .split(os.sep)[0]) for path in paths]
+
+
+def archived_days():
+    """
+    Yields the channel and day of each archived segment.
+    """
+    if not settings.ARCHIVE_DIR:
+        return
+    pattern = os.path.join(settings.ARCHIVE_DIR, "*", "[0-9]" * 4,
+                           "[0-9]" * 2, "[0-9][0-9].jsonl.gz")
+    for path in sorted(glob(pattern)):
+        parts = path[len(settings.ARCHIVE_DIR):].lstrip(os.sep).split(os.sep)
+        channel, year, month, name = parts
+        yield unquote(channel), date(int(year), int(month), int(name[:2]))
+
+
+def read_day(day):
+    """
+    Yields the messages archived for the day in all channels, in the
+    order they were logged.
+    """
+    segments = [((m.message_time, m.id, m) for m in read_segment(c, day))
+                for c in archived_channels(day)]
+    for _, _, message in merge(*segments):
+        yield message
+
+
+def message_to_dict(message):
+    """
+    Serializes a message for a segment. Times are stored as UTC when
+    Django's timezone support is used.
+    """
+    data = dict([(name, getattr(message, name)) for name in FIELDS])
+    message_time = message.message_time
+    if is_aware(message_time):
+        message_time = make_naive(message_time, utc)
+    data["message_time"] = message_time.strftime(TIME_FORMAT)
+    return data
+
+
+def dict_to_message(data):
+    """
+    Creates an unsaved message from a segment's serialized message.
+    Segments written before messages were stored with their rendered
+    HTML are rendered as they're read. The rendered HTML is only
+    trusted for segments written by ``write_segment``.
+    """
+    message_time = datetime.strptime(data["message_time"], TIME_FORMAT)
+    if django_settings.USE_TZ:
+        message_time = message_time.replace(tzinfo=utc)
+    fields = dict([(str(name), data[name]) for name in FIELDS
+                   if name in data])
+    message = IRCMessage(message_time=message_time, **fields)
+    if not message.message_html:
+        message.render()
+    return message
+
+
+def read_segment(channel, day):
+    """
+    Yields the messages in a segment, in the order they were logged.
+    """
+    segment = GzipFile(segment_path(channel, day), "rb")
+    try:
+        for line in segment:
+            yield dict_to_message(loads(line))
+    finally:
+        segment.close()
+
+
+def write_segment(channel, day, messages):
+    """
+    Writes the messages to the day's segment, merging them with any
+    messages already archived for the day. The segment is written to
+    a temporary file first, so readers never see a partial segment.
+    """
+    messages = dict([(message.id, message) for message in messages])
+    if archived(channel, day):
+        for message in read_segment(channel, day):
+            messages.setdefault(message.id, message)
+    messages = sorted(messages.values(),
+                      key=lambda message: (message.message_time, message.id))
+    path = segment_path(channel, day)
+    try:
+        os.makedirs(os.path.dirname(path))
+    except OSError:
+        pass
+    temp_path = "%s.%s.tmp" % (path, os.getpid())
+    segment = GzipFile(temp_path, "wb")
+    try:
+        for message in messages:
+            segment.write(dumps(message_to_dict(message)) + "\n")
+    finally:
+        segment.close()
+    os.rename(temp_path, path)
+    return len(messages)
@@ -1,15 +1,34 @@
 
-from collections import defaultdict
-from inspect import getargspec
+from collections import defaultdict, namedtuple
+from inspect import getargspec, getdoc
 from logging import Formatter, StreamHandler, getLogger
 from re import match
 
-from gevent import sleep, spawn
-
-from gnotty.client import BaseIRCClient
+from gnotty.bots.handlers import HandlerRunner
+from gnotty.bots.timers import TimerScheduler
+from gnotty.client import BaseIRCClient, PRIORITY_COMMAND, PRIORITY_DEFAULT
 from gnotty.conf import settings
 
 
+Command = namedtuple("Command", ["handler", "num_pos_args", "num_all_args",
+                                 "args", "help"])
+
+
+def command_for(handler):
+    """
+    Inspects a command handler's arguments and docstring, so that
+    this isn't done each time the command is used.
+    """
+    argspec = getargspec(handler)
+    args = argspec.args[2:]  # Ignore self/event args
+    defaults = argspec.defaults or []
+    num_pos_args = len(args) - len(defaults)
+    for i in range(-1, -len(defaults) - 1, -1):
+        args[i] = "%s [default: %s]" % (args[i], defaults[i])
+    help = (getdoc(handler) or "").replace("\n", " ")
+    return Command(handler, num_pos_args, len(args), ", ".join(args), help)
+
+
 class BaseBot(BaseIRCClient):
     """
     Base bot class. Bots can be built by subclassing ``BaseBot`` and
@@ -25,7 +44,10 @@ class BaseBot(BaseIRCClient):
             which are any methods defined on any classes in the
             inheritance heirarchy, that have been marked with an
             "event" attribute, which gets assgined by the
-            ``gnotty.bots.events.on`` decorator.
+            ``gnotty.bots.events.on`` decorator. Also build a table
+            of command names to their commands, and the set of first
+            characters of command names, for quickly skipping
+            messages that can't be commands.
             """
             def all_bases(bases):
                 for base in bases:
@@ -37,11 +59,18 @@ class BaseBot(BaseIRCClient):
             for member in sum(base_values, attrs.values()):
                 if hasattr(member, "event"):
                     attrs["events"][member.event.name].append(member)
+            attrs["command_table"] = {}
+            for handler in attrs["events"]["command"]:
+                command_name = handler.event.args["command"]
+                commands = attrs["command_table"].setdefault(command_name, [])
+                commands.append(command_for(handler))
+            attrs["command_prefixes"] = frozenset(
+                [name[:1] for name in attrs["command_table"]])
             return type.__new__(cls, name, bases, attrs)
 
     def __init__(self, *args, **kwargs):
         """
-        Sets up logging and interval events.
+        Sets up logging, handler execution and timer events.
         """
         super(BaseBot, self).__init__(*args, **kwargs)
         fmt = Formatter("[%(server)s%(channel)s] %(nickname)s: %(message)s")
@@ -50,9 +79,15 @@ class BaseBot(BaseIRCClient):
         logger = getLogger("irc.message")
         logger.setLevel(settings.LOG_LEVEL)
         logger.addHandler(handler)
-        # Spawn a thread (greenlet) for each timer event handler.
+        self.handlers = HandlerRunner()
+        # Check each handler's run mode now, rather than on its first
+        # event.
+        for handler in sum(self.events.values(), []):
+            self.handlers.get(handler)
+        # Run all timer event handlers from a single scheduler.
+        self.timers = TimerScheduler(self)
         for handler in self.events.get("timer", []):
-            spawn(self.handle_timer_event, handler)
+            self.timers.add(handler)
 
     def _dispatcher(self, connection, event):
         """
@@ -62,7 +97,7 @@ class BaseBot(BaseIRCClient):
         """
         super(BaseBot, self)._dispatcher(connection, event)
         for handler in self.events[event.eventtype()]:
-            handler(self, connection, event)
+            self.handlers.call(handler, handler, self, connection, event)
 
     def log(self, event, message, join_or_leave=False):
         extra = {
@@ -73,12 +108,12 @@ class BaseBot(BaseIRCClient):
         }
         getLogger("irc.message").info(message, extra=extra)
 
-    def message_channel(self, message):
+    def message_channel(self, message, priority=PRIORITY_DEFAULT):
         """
         We won't receive our own messages, so log them manually.
         """
         self.log(None, message)
-        super(BaseBot, self).message_channel(message)
+        super(BaseBot, self).message_channel(message, priority)
 
     def on_join(self, connection, event):
         self.log(event, "joins", join_or_leave=True)
@@ -95,11 +130,13 @@ class BaseBot(BaseIRCClient):
         """
         for message in event.arguments():
             self.log(event, message)
-            command_args = filter(None, message.split())
+            if message.lstrip()[:1] not in self.command_prefixes:
+                continue
+            command_args = message.split()
             command_name = command_args.pop(0)
-            for handler in self.events["command"]:
-                if handler.event.args["command"] == command_name:
-                    self.handle_command_event(event, handler, command_args)
+            for command in self.command_table.get(command_name, []):
+                self.handlers.call(command.handler, self.handle_command_event,
+                                   event, command, command_args)
 
     def handle_command_event(self, event, command, args):
         """
@@ -108,11 +145,10 @@ class BaseBot(BaseIRCClient):
         and does some validation to ensure that the number of
         arguments match.
         """
-        argspec = getargspec(command)
-        num_all_args = len(argspec.args) - 2  # Ignore self/event args
-        num_pos_args = num_all_args - len(argspec.defaults or [])
+        num_all_args = command.num_all_args
+        num_pos_args = command.num_pos_args
         if num_pos_args <= len(args) <= num_all_args:
-            response = command(self, event, *args)
+            response = command.handler(self, event, *args)
         elif num_all_args == num_pos_args:
             s = "s are" if num_all_args != 1 else " is"
             response = "%s arg%s required" % (num_all_args, s)
@@ -120,15 +156,14 @@ class BaseBot(BaseIRCClient):
             bits = (num_pos_args, num_all_args)
             response = "between %s and %s args are required" % bits
         response = "%s: %s" % (self.get_nickname(event), response)
-        self.message_channel(response)
+        self.message_channel(response, PRIORITY_COMMAND)
 
     def handle_timer_event(self, handler):
         """
-        Runs each timer handler in a separate greenlet thread.
+        Timer handler - called by the bot's ``TimerScheduler`` each
+        time a timer event handler is due to run.
         """
-        while True:
-            handler(self)
-            sleep(handler.event.args["seconds"])
+        handler(self)
 
     def handle_webhook_event(self, environ, url, params):
         """
@@ -136,10 +171,29 @@ class BaseBot(BaseIRCClient):
         takes an initial pattern argument for matching the URL
         requested. Here we match the URL to the pattern for each
         webhook handler, and bail out if it returns a response.
+        Handlers that aren't ``fast`` are called after the request
+        has been responded to, so their responses aren't used.
         """
         for handler in self.events["webhook"]:
             urlpattern = handler.event.args["urlpattern"]
             if not urlpattern or match(urlpattern, url):
-                response = handler(self, environ, url, params)
+                response = self.handlers.call(handler, handler, self,
+                                              environ, url, params)
                 if response:
                     return response
+
+    def close(self):
+        """
+        Stops the handler workers and worker processes, when the
+        server shuts down.
+        """
+        self.handlers.close()
+
+    def cpu_apply(self, func, *args, **kwargs):
+        """
+        Calls the function in one of the bot's worker processes and
+        returns its result, for CPU bound work that would otherwise
+        block the bot's other event handlers. The function needs to
+        be importable, and its args and result able to be pickled.
+        """
+        return self.handlers.processes.apply(func, *args, **kwargs)
@@ -1,36 +1,99 @@
 
+from logging import getLogger
 from random import choice, randint
+from re import sub
 
-from gevent import sleep
+from gevent import spawn, spawn_later
 
 from gnotty.bots import events
+from gnotty.cache import LRUCache
+
+
+chatbots = None
+
+
+def load_chatbots():
+    """
+    Imports ``nltk.chat`` and creates each of its chat bots, the first
+    time it's called in a process. Returns the number of chat bots,
+    which is zero if nltk isn't installed.
+    """
+    global chatbots
+    if chatbots is None:
+        try:
+            from nltk.chat import bots
+        except ImportError:
+            chatbots = []
+        else:
+            get_bot = lambda x: x[0].func_globals["%sbot" % x[0].__name__]
+            chatbots = map(get_bot, bots)
+    return len(chatbots)
+
+
+def nltk_responder(message):
+    """
+    Default responder for ``ChatMixin``, which replies to the message
+    with one of nltk's chat bots, chosen at random.
+    """
+    if not load_chatbots():
+        raise ImportError("ChatMixin requires nltk installed")
+    return choice(chatbots).respond(message)
+
+
+def normalize(message):
+    """
+    Key for caching the reply to a message, so that messages that
+    only differ by case, spacing or trailing punctuation share a
+    reply.
+    """
+    return sub(r"\s+", " ", message.lower()).strip(" .!?")
 
 
 class ChatMixin(object):
     """
     Mixin for a chat bot that greets and responds to people.
+
+    Replies are generated by the ``chat_responder`` keyword arg to
+    ``__init__``, which defaults to ``nltk_responder``, and is called
+    with the message addressed to the bot in one of the bot's worker
+    processes, so the responder needs to be importable from a module.
+    nltk is only loaded in the worker process, in the background when
+    the bot starts, or when the bot is first addressed if the
+    ``chat_warmup`` keyword arg is False. The replies to the
+    ``chat_cache_size`` most recently used messages are cached.
     """
 
     def __init__(self, *args, **kwargs):
+        self.chat_responder = kwargs.pop("chat_responder", nltk_responder)
+        self.chat_replies = LRUCache(kwargs.pop("chat_cache_size", 1000))
+        self.chat_enabled = True
+        chat_warmup = kwargs.pop("chat_warmup", True)
         super(ChatMixin, self).__init__(*args, **kwargs)
-        self.chatbots = []
         self.greetings = ("Hi", "Hello", "Howdy", "Welcome")
+        if chat_warmup and self.chat_responder is nltk_responder:
+            spawn(self.warmup_chatbots)
+
+    def warmup_chatbots(self):
+        """
+        Loads nltk's chat bots in a worker process, so that the first
+        reply isn't delayed by it.
+        """
         try:
-            from nltk.chat import bots
-        except ImportError:
+            loaded = self.cpu_apply(load_chatbots)
+        except Exception:
+            getLogger("irc.dispatch").exception("Couldn't load chat bots")
+            return
+        if not loaded:
             from warnings import warn
             warn("ChatMixin requires nltk installed")
-        else:
-            get_bot = lambda x: x[0].func_globals["%sbot" % x[0].__name__]
-            self.chatbots = map(get_bot, bots)
+            self.chat_enabled = False
 
     def message_channel_delayed(self, message):
         """
         Pause for a random few seconds before messaging, to seem less
         bot like.
         """
-        sleep(randint(2, 5))
-        self.message_channel(message)
+        spawn_later(randint(2, 5), self.message_channel, message)
 
     @events.on("join")
     def greet(self, connection, event):
@@ -41,12 +104,46 @@ class ChatMixin(object):
 
     @events.on("pubmsg")
     def respond(self, connection, event):
-        if not self.chatbots:
+        """
+        Checks each message for the bot's nickname, and passes the
+        messages addressed to the bot to ``respond_to``, so that only
+        those wait for a free ``cpu`` handler.
+        """
+        if not self.chat_enabled:
             return
+        respond_to = ChatMixin.respond_to.im_func
         for message in event.arguments():
             prefix = "%s: " % self.nickname
             if message.startswith(prefix):
                 nickname = self.get_nickname(event)
-                chatbot = choice(self.chatbots)
-                reply = chatbot.respond(message.replace(prefix, "", 1))
-                self.message_channel_delayed("%s: %s" % (nickname, reply))
+                self.handlers.call(respond_to, respond_to, self, nickname,
+                                   message.replace(prefix, "", 1))
+
+    @events.on("chat", run="cpu", timeout=30)
+    def respond_to(self, nickname, message):
+        """
+        Replies to a message addressed to the bot. Not an IRC event,
+        the event only gives the run mode and timeout for replies.
+        """
+        reply = self.reply(message)
+        if reply:
+            self.message_channel_delayed("%s: %s" % (nickname, reply))
+
+    def reply(self, message):
+        """
+        Returns the cached reply for the message, or the reply from
+        the responder called in a worker process.
+        """
+        key = normalize(message)
+        try:
+            return self.chat_replies[key]
+        except KeyError:
+            pass
+        try:
+            reply = self.cpu_apply(self.chat_responder, message)
+        except ImportError, e:
+            getLogger("irc.dispatch").error(e)
+            self.chat_enabled = False
+            return None
+        self.chat_replies[key] = reply
+        return reply
@@ -1,6 +1,5 @@
 
 from datetime import datetime
-from inspect import getdoc, getargspec
 
 from gnotty.bots import events
 from gnotty.conf import settings
@@ -67,8 +66,8 @@ class CommandMixin(object):
         return " and ".join(", ".join(parts).rsplit(", ", 1))
 
     def commands_dict(self):
-        commands = self.events["command"]
-        return dict([(c.event.args["command"], c) for c in commands])
+        return dict([(name, commands[-1].handler) for name, commands
+                     in self.command_table.items()])
 
     ##############
     #  Commands  #
@@ -87,7 +86,7 @@ class CommandMixin(object):
         """
         Lists all available commands.
         """
-        commands = sorted(self.commands_dict().keys())
+        commands = sorted(self.command_table.keys())
         return "Available commands: %s" % " ".join(commands)
 
     @events.on("command", command="!help")
@@ -100,18 +99,11 @@ class CommandMixin(object):
             return ("Type !commands for a list of all commands. Type "
                     "!help [command] to see help for a specific command.")
         try:
-            command = self.commands_dict()[command_name]
+            command = self.command_table[command_name][-1]
         except KeyError:
             return "%s is not a command" % command_name
-
-        argspec = getargspec(command)
-        args = argspec.args[2:]
-        defaults = argspec.defaults or []
-        for i in range(-1, -len(defaults) - 1, -1):
-            args[i] = "%s [default: %s]" % (args[i], defaults[i])
-        args = ", ".join(args)
-        help = getdoc(command).replace("\n", " ")
-        return "help for %s: (args: %s) %s" % (command_name, args, help)
+        return "help for %s: (args: %s) %s" % (command_name, command.args,
+                                               command.help)
 
     @events.on("command", command="!uptime")
     def uptime(self, event, nickname=None):
@@ -2,6 +2,7 @@
 from json import loads
 
 from gnotty.bots import events
+from gnotty.client import PRIORITY_COMMIT
 
 
 class CommitMixin(object):
@@ -22,7 +23,7 @@ class CommitMixin(object):
             messages.insert(0, "%s new commits:" % len(payload.commits()))
             messages.append("Compare view: %s" % payload.diff_url())
         for message in messages:
-            self.message_channel(message)
+            self.message_channel(message, PRIORITY_COMMIT)
 
 
 class CommitPayload(object):
@@ -0,0 +1,160 @@
+
+from logging import getLogger
+from time import time
+
+from gevent import killall, spawn, Timeout
+from gevent.queue import Full, Queue
+
+from gnotty.bots.processes import ProcessPool
+from gnotty.conf import settings
+
+
+class Handler(object):
+    """
+    An event handler's execution options, given by the ``run`` and
+    ``timeout`` keyword args to its ``gnotty.bots.events.on``
+    decorator, and stats for its calls.
+    """
+
+    run_modes = ("fast", "io", "cpu")
+
+    def __init__(self, handler):
+        args = handler.event.args
+        self.name = handler.__name__
+        self.run = args.get("run", "fast")
+        self.timeout = args.get("timeout")
+        if self.run not in self.run_modes:
+            raise ValueError("Handler run mode for %s must be one of: %s" %
+                             (self.name, ", ".join(self.run_modes)))
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.dropped = 0
+        self.total_wait = 0
+        self.max_wait = 0
+        self.total_time = 0
+        self.max_time = 0
+
+    def stats(self):
+        calls = self.calls or 1
+        return {
+            "run": self.run,
+            "calls": self.calls,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "dropped": self.dropped,
+            "average_wait": self.total_wait / calls,
+            "max_wait": self.max_wait,
+            "average_time": self.total_time / calls,
+            "max_time": self.max_time,
+        }
+
+
+class HandlerRunner(object):
+    """
+    Calls a bot's event handlers according to their run mode, so
+    that slow handlers don't hold up the processing of IRC events,
+    such as replying to the server's pings. ``fast`` handlers are
+    called immediately, as event handlers always were. ``io``
+    handlers are called by ``HANDLER_POOL_SIZE`` worker greenlets.
+    ``cpu`` handlers are called by ``HANDLER_PROCESSES`` worker
+    greenlets, and are expected to pass their CPU bound work to the
+    bot's ``cpu_apply`` method, which runs it in a pool of worker
+    processes. Each run mode's calls wait in a queue of at most
+    ``HANDLER_QUEUE_SIZE`` calls, and calls are dropped when it's
+    full, so that the bot is never held up by busy handlers.
+    Exceptions raised by ``io`` and ``cpu`` handlers are logged,
+    since there's no caller for them to be raised to.
+    """
+
+    def __init__(self):
+        self.handlers = {}
+        self.queues = {}
+        self.workers = []
+        for run, size in (("io", settings.HANDLER_POOL_SIZE),
+                          ("cpu", settings.HANDLER_PROCESSES)):
+            self.queues[run] = Queue(settings.HANDLER_QUEUE_SIZE)
+            for _ in range(size):
+                self.workers.append(spawn(self.work, self.queues[run]))
+        self.processes = ProcessPool(settings.HANDLER_PROCESSES)
+
+    def get(self, handler):
+        try:
+            return self.handlers[handler]
+        except KeyError:
+            return self.handlers.setdefault(handler, Handler(handler))
+
+    def call(self, handler, func, *args):
+        """
+        Calls ``func`` with the args, using the run mode and timeout
+        of the event handler ``handler``. ``func`` is usually the
+        handler itself, but may be a method that calls the handler,
+        such as for commands. Returns the result of ``func`` for
+        ``fast`` handlers, and None for others, as they're called
+        later.
+        """
+        options = self.get(handler)
+        if options.run == "fast":
+            return self.timed(options, time(), func, *args)
+        try:
+            self.queues[options.run].put_nowait((options, time(), func,
+                                                 args))
+        except Full:
+            options.dropped += 1
+            getLogger("irc.dispatch").error("Handler %s dropped an event, "
+                                            "the %s queue is full" %
+                                            (options.name, options.run))
+
+    def work(self, queue):
+        """
+        Worker greenlet that calls the handlers waiting in a queue.
+        """
+        for options, queued, func, args in queue:
+            self.timed(options, queued, func, *args)
+
+    def timed(self, options, queued, func, *args):
+        """
+        Calls ``func`` and records its stats, including the time it
+        spent waiting in its queue.
+        """
+        start = time()
+        wait = start - queued
+        options.total_wait += wait
+        options.max_wait = max(options.max_wait, wait)
+        try:
+            with Timeout(options.timeout):
+                return func(*args)
+        except Timeout:
+            options.timeouts += 1
+            getLogger("irc.dispatch").error("Handler %s timed out after %ss"
+                                            % (options.name, options.timeout))
+            if options.run == "fast":
+                raise
+        except Exception, e:
+            options.errors += 1
+            if options.run == "fast":
+                raise
+            message = "Handler %s raised an exception" % options.name
+            worker_traceback = getattr(e, "worker_traceback", None)
+            if worker_traceback:
+                message += ", in a worker process:\n%s" % worker_traceback
+            getLogger("irc.dispatch").exception(message)
+        finally:
+            run_time = time() - start
+            options.calls += 1
+            options.total_time += run_time
+            options.max_time = max(options.max_time, run_time)
+
+    def close(self):
+        """
+        Stops the worker greenlets and worker processes.
+        """
+        killall(self.workers)
+        self.processes.close()
+
+    def stats(self):
+        """
+        Stats for each handler, keyed by the name of the handler.
+        """
+        return dict([(options.name, options.stats())
+                     for options in self.handlers.values()])
@@ -0,0 +1,146 @@
+
+from cPickle import dumps, loads, HIGHEST_PROTOCOL
+import sys
+from traceback import format_exc
+
+from gevent.queue import Queue
+from gevent.subprocess import Popen, PIPE
+
+
+def read_message(stream):
+    """
+    Reads a pickled message, preceded by a line containing its length.
+    Returns None if the stream has closed.
+    """
+    length = stream.readline()
+    if not length:
+        return None
+    return loads(stream.read(int(length)))
+
+
+def write_message(stream, message):
+    """
+    Writes a pickled message, preceded by a line containing its length.
+    """
+    data = dumps(message, HIGHEST_PROTOCOL)
+    stream.write("%s\n%s" % (len(data), data))
+    stream.flush()
+
+
+class WorkerProcess(object):
+    """
+    A Python process that calls functions sent to it, using this
+    module's ``main`` function. The functions and their arguments
+    are pickled, so the functions need to be importable from a
+    module.
+    """
+
+    def __init__(self):
+        args = [sys.executable, "-m", "gnotty.bots.processes"]
+        self.process = Popen(args, stdin=PIPE, stdout=PIPE)
+
+    def apply(self, func, args, kwargs):
+        """
+        Returns whether the call succeeded, and either its result or
+        the exception it raised along with its traceback.
+        """
+        write_message(self.process.stdin, (func, args, kwargs))
+        reply = read_message(self.process.stdout)
+        if reply is None:
+            raise RuntimeError("Worker process exited with code %s" %
+                               self.process.wait())
+        return reply
+
+    def kill(self):
+        try:
+            self.process.kill()
+            self.process.wait()
+        except OSError:
+            pass
+
+
+class ProcessPool(object):
+    """
+    A pool of worker processes, for CPU bound work that would
+    otherwise block the greenlets of the IRC bot while it runs. The
+    multiprocessing module can't be used with gevent's monkey
+    patching, as its result handling blocks the process while
+    waiting, so each process is a child process communicated with
+    over gevent's pipes instead. Processes are started as they're
+    first needed, and a process is replaced if its call is
+    interrupted, such as by a timeout, since its reply can no longer
+    be matched up to a call.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.started = 0
+        self.idle = Queue()
+
+    def apply(self, func, *args, **kwargs):
+        """
+        Calls the function in a worker process, waiting until a
+        process is free, and returns the function's result. Any
+        exception raised by the function is raised here, with the
+        traceback from the worker process as its ``worker_traceback``
+        attribute.
+        """
+        if self.idle.empty() and self.started < self.size:
+            self.started += 1
+            try:
+                self.idle.put(WorkerProcess())
+            except:
+                self.started -= 1
+                raise
+        worker = self.idle.get()
+        try:
+            ok, result = worker.apply(func, args, kwargs)
+        except:
+            worker.kill()
+            self.started -= 1
+            raise
+        self.idle.put(worker)
+        if not ok:
+            error, error_traceback = result
+            error.worker_traceback = error_traceback
+            raise error
+        return result
+
+    def close(self):
+        """
+        Stops the idle worker processes.
+        """
+        while not self.idle.empty():
+            self.idle.get().kill()
+            self.started -= 1
+
+
+def main():
+    """
+    Worker process loop, which reads each function and its args from
+    stdin, and writes whether the call succeeded and its result, or
+    the exception raised and its traceback, to stdout.
+    """
+    stdin, stdout = sys.stdin, sys.stdout
+    # Keep anything the functions print out of the replies.
+    sys.stdout = sys.stderr
+    while True:
+        message = read_message(stdin)
+        if message is None:
+            break
+        func, args, kwargs = message
+        try:
+            reply = (True, func(*args, **kwargs))
+        except Exception, e:
+            reply = (False, (e, format_exc()))
+        try:
+            write_message(stdout, reply)
+        except Exception:
+            # The result or exception couldn't be pickled.
+            error_traceback = format_exc()
+            write_message(stdout, (False, (RuntimeError(error_traceback),
+                                           error_traceback)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,18 @@
 
+from collections import deque
+from json import dump, load
+from logging import getLogger
+import os
+
 try:
     from feedparser import parse
 except ImportError:
     parse = None
+from gevent.pool import Pool
 
 from gnotty.bots import events
+from gnotty.cache import LRUCache
+from gnotty.client import PRIORITY_RSS
 
 
 class RSSMixin(object):
@@ -13,6 +21,18 @@ class RSSMixin(object):
     channel. Feeds are defined by the ``feeds`` keyword arg to
     ``__init__``, and should contain a sequence of RSS feed URLs.
 
+    Feeds are fetched concurrently, at most ``feed_pool_size`` at
+    once, using the ETag and Last-Modified headers from the previous
+    fetch so that unchanged feeds aren't downloaded again. The first
+    fetch of each feed only records its current items, so that only
+    items added after the bot starts are posted. At most
+    ``feed_batch_size`` new items are posted each minute, with any
+    others posted in the minutes that follow, keeping at most
+    ``feed_backlog_size`` items waiting. The IDs of items seen
+    are kept for the ``feed_seen_size`` most recently seen items,
+    and saved to the ``feed_seen_file`` path when given, so that
+    items aren't posted again when the bot restarts.
+
     Requires the ``feedparser`` library to be installed.
     """
 
@@ -21,30 +41,129 @@ class RSSMixin(object):
             from warnings import warn
             warn("RSSMixin requires feedparser installed")
         self.feeds = kwargs.pop("feeds", [])
-        self.feed_items = set()
-        # Consume initial feed items without posting them.
-        self.parse_feeds(message_channel=False)
+        self.feed_pool = Pool(kwargs.pop("feed_pool_size", 5))
+        self.feed_batch_size = kwargs.pop("feed_batch_size", 5)
+        self.feed_seen_file = kwargs.pop("feed_seen_file", None)
+        self.feed_items = LRUCache(kwargs.pop("feed_seen_size", 10000))
+        self.feed_state = {}
+        self.feed_backlog = deque(maxlen=kwargs.pop("feed_backlog_size", 100))
+        self.feed_items_changed = False
+        self.load_feed_items()
         super(RSSMixin, self).__init__(*args, **kwargs)
 
-    @events.on("timer", seconds=60)
-    def parse_feeds(self, message_channel=True):
+    def load_feed_items(self):
         """
-        Iterates through each of the feed URLs, parses their items, and
-        sends any items to the channel that have not been previously
-        been parsed.
+        Loads the IDs of previously seen items, and which feeds they
+        came from, from ``feed_seen_file``.
+        """
+        if not self.feed_seen_file or not os.path.exists(self.feed_seen_file):
+            return
+        try:
+            with open(self.feed_seen_file, "r") as f:
+                data = load(f)
+        except (IOError, ValueError), e:
+            getLogger("irc.dispatch").error("Couldn't load seen RSS items "
+                                            "from %s: %s" %
+                                            (self.feed_seen_file, e))
+            return
+        for item_id in data["items"]:
+            self.feed_items[item_id] = True
+        for feed_url in data["feeds"]:
+            self.feed_state[feed_url] = {"primed": True}
+
+    def save_feed_items(self):
+        """
+        Saves the IDs of seen items to ``feed_seen_file``, least
+        recently seen first. Written to a temporary file first so
+        that a partially written file is never loaded.
+        """
+        if not self.feed_seen_file:
+            return
+        data = {
+            "items": self.feed_items.keys(),
+            "feeds": [url for url, state in self.feed_state.items()
+                      if state.get("primed")],
+        }
+        temp_path = self.feed_seen_file + ".tmp"
+        with open(temp_path, "w") as f:
+            dump(data, f)
+        os.rename(temp_path, self.feed_seen_file)
+
+    @events.on("timer", seconds=60, jitter=5)
+    def parse_feeds(self):
+        """
+        Fetches all of the feeds concurrently, and sends the next
+        batch of new items to the channel.
         """
         if parse:
-            for feed_url in self.feeds:
-                feed = parse(feed_url)
-                for item in feed.entries:
-                    if item["id"] not in self.feed_items:
-                        self.feed_items.add(item["id"])
-                        if message_channel:
-                            message = self.format_item_message(feed, item)
-                            self.message_channel(message)
-                            return
-
-    def format_item_message(self, feed, item):
-        item["feed_title"] = feed.feed.title or feed.url
-        return "%(title)s: %(id)s (via %(feed_title)s)" % item
+            self.feed_items_changed = False
+            for messages in self.feed_pool.imap_unordered(self.parse_feed,
+                                                          self.feeds):
+                backlog = len(self.feed_backlog) + len(messages)
+                dropped = backlog - self.feed_backlog.maxlen
+                if dropped > 0:
+                    getLogger("irc.dispatch").warning("RSS backlog is full, "
+                                                      "dropping the oldest "
+                                                      "%s items" % dropped)
+                self.feed_backlog.extend(messages)
+            if self.feed_items_changed:
+                self.save_feed_items()
+        for _ in range(min(self.feed_batch_size, len(self.feed_backlog))):
+            self.message_channel(self.feed_backlog.popleft(), PRIORITY_RSS)
+
+    def parse_feed(self, feed_url):
+        """
+        Fetches a feed if it has changed since it was last fetched,
+        and returns messages for any of its items not seen before.
+        Nothing is returned the first time a feed is fetched
+        successfully. Errors are logged rather than raised, so that
+        they don't stop the other feeds from being posted.
+        """
+        state = self.feed_state.setdefault(feed_url, {})
+        try:
+            feed = parse(feed_url, etag=state.get("etag"),
+                         modified=state.get("modified"))
+        except Exception, e:
+            getLogger("irc.dispatch").error("Couldn't fetch RSS feed %s: %s"
+                                            % (feed_url, e))
+            return []
+        status = feed.get("status")
+        if status == 304:
+            return []
+        if (status is None and not feed.entries) or status >= 400:
+            # The feed couldn't be fetched, so it isn't primed, since
+            # its items would otherwise all be posted once it is.
+            error = feed.get("bozo_exception") or "status %s" % status
+            getLogger("irc.dispatch").error("Couldn't fetch RSS feed %s: %s"
+                                            % (feed_url, error))
+            return []
+        state["etag"] = feed.get("etag")
+        state["modified"] = feed.get("modified")
+        messages = []
+        for item in feed.entries:
+            item_id = item.get("id") or item.get("link")
+            if item_id and item_id not in self.feed_items:
+                self.feed_items[item_id] = True
+                self.feed_items_changed = True
+                if not state.get("primed"):
+                    continue
+                try:
+                    message = self.format_item_message(feed, item, item_id)
+                except Exception:
+                    getLogger("irc.dispatch").exception("Couldn't format RSS "
+                                                        "item %s from %s" %
+                                                        (item_id, feed_url))
+                else:
+                    messages.append(message)
+        state["primed"] = True
+        return messages
 
+    def format_item_message(self, feed, item, item_id=None):
+        """
+        Message for a new item, given the item's ID, which is its link
+        if it has no ID.
+        """
+        item_id = item_id or item.get("id") or item.get("link")
+        title = item.get("title") or item_id
+        feed_title = feed.feed.get("title") or feed.get("href")
+        return "%s: %s (via %s)" % (title, item_id, feed_title)
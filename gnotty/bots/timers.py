@@ -0,0 +1,175 @@
+
+from heapq import heappop, heappush
+from itertools import count
+from logging import getLogger
+from random import uniform
+from time import time
+
+from gevent import spawn, Timeout
+from gevent.event import Event
+
+
+class Timer(object):
+    """
+    A timer event handler, along with the options given to its
+    ``gnotty.bots.events.on`` decorator, and stats for its runs.
+    """
+
+    modes = ("delay", "rate")
+    missed_policies = ("skip", "catchup")
+
+    def __init__(self, handler):
+        args = handler.event.args
+        self.handler = handler
+        self.name = handler.__name__
+        self.seconds = args["seconds"]
+        self.mode = args.get("mode", "delay")
+        self.jitter = args.get("jitter", 0)
+        self.missed = args.get("missed", "skip")
+        self.timeout = args.get("timeout")
+        if self.mode not in self.modes:
+            raise ValueError("Timer mode for %s must be one of: %s" %
+                             (self.name, ", ".join(self.modes)))
+        if self.missed not in self.missed_policies:
+            raise ValueError("Timer missed policy for %s must be one of: %s" %
+                             (self.name, ", ".join(self.missed_policies)))
+        self.cancelled = False
+        self.runs = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.total_time = 0
+        self.max_time = 0
+        self.max_lateness = 0
+
+    def next_due(self, due, start, finish):
+        """
+        Returns the time the timer should next run, given the time it
+        was due to run, and when its run started and finished. In
+        ``delay`` mode, the next run is ``seconds`` after the run
+        finished. In ``rate`` mode, the next run is ``seconds`` after
+        the time the run was due, regardless of how long it took. If
+        that time has already passed, the ``skip`` policy skips the
+        missed runs, while the ``catchup`` policy runs immediately
+        until the missed runs are made up.
+        """
+        if self.mode == "delay":
+            next_due = finish + self.seconds
+        else:
+            next_due = due + self.seconds
+            if next_due < finish and self.missed == "skip":
+                missed = int((finish - next_due) // self.seconds) + 1
+                self.skipped += missed
+                next_due += missed * self.seconds
+        if self.jitter:
+            next_due += uniform(0, self.jitter)
+        return next_due
+
+    def stats(self):
+        return {
+            "runs": self.runs,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "overruns": self.overruns,
+            "skipped": self.skipped,
+            "average_time": self.total_time / (self.runs or 1),
+            "max_time": self.max_time,
+            "max_lateness": self.max_lateness,
+        }
+
+
+class TimerScheduler(object):
+    """
+    Runs all of a bot's timer event handlers from a single greenlet,
+    using a heap of the times each timer is next due. Each run of a
+    timer happens in its own greenlet, so that a slow handler doesn't
+    delay other timers, but a timer is only scheduled again once its
+    current run has finished, so runs of the same timer never overlap.
+    Exceptions raised by handlers are logged, and the timer continues.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.heap = []
+        self.timers = {}
+        self.counter = count()
+        self.wake = Event()
+        self.greenlet = None
+
+    def add(self, handler):
+        """
+        Adds a timer for the handler, which first runs after a random
+        delay of up to its ``jitter`` seconds.
+        """
+        timer = Timer(handler)
+        self.timers[timer.name] = timer
+        self.schedule(timer, time() + uniform(0, timer.jitter))
+        if self.greenlet is None:
+            self.greenlet = spawn(self.run)
+        return timer
+
+    def cancel(self, name):
+        """
+        Stops the timer for the handler with the given name.
+        """
+        self.timers.pop(name).cancelled = True
+
+    def schedule(self, timer, due):
+        heappush(self.heap, (due, next(self.counter), timer))
+        self.wake.set()
+
+    def run(self):
+        """
+        Waits until the next timer is due, and runs it.
+        """
+        while True:
+            self.wake.clear()
+            if not self.heap:
+                self.wake.wait()
+                continue
+            due, _, timer = self.heap[0]
+            delay = due - time()
+            if delay > 0:
+                self.wake.wait(delay)
+                continue
+            heappop(self.heap)
+            if not timer.cancelled:
+                spawn(self.fire, timer, due)
+
+    def fire(self, timer, due):
+        """
+        Runs a timer's handler, records its stats, and schedules its
+        next run.
+        """
+        logger = getLogger("irc.dispatch")
+        start = time()
+        timer.max_lateness = max(timer.max_lateness, start - due)
+        try:
+            with Timeout(timer.timeout):
+                self.bot.handle_timer_event(timer.handler)
+        except Timeout:
+            timer.timeouts += 1
+            logger.error("Timer %s timed out after %ss" %
+                         (timer.name, timer.timeout))
+        except Exception:
+            timer.errors += 1
+            logger.exception("Timer %s raised an exception" % timer.name)
+        finish = time()
+        run_time = finish - start
+        timer.runs += 1
+        timer.total_time += run_time
+        timer.max_time = max(timer.max_time, run_time)
+        if run_time > timer.seconds:
+            timer.overruns += 1
+            logger.debug("Timer %s took %.2fs, longer than its %ss "
+                         "interval" % (timer.name, run_time, timer.seconds))
+        if not timer.cancelled:
+            self.schedule(timer, timer.next_due(due, start, finish))
+
+    def stats(self):
+        """
+        Stats for each timer, keyed by the name of its handler.
+        """
+        return dict([(name, timer.stats())
+                     for name, timer in self.timers.items()])
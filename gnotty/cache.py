@@ -0,0 +1,74 @@
+from collections import OrderedDict
+from time import time
+
+
+class LRUCache(object):
+    """
+    Dict-like cache that holds at most ``maxsize`` items, discarding
+    the least recently used item when full. Items expire after
+    ``ttl`` seconds when given, which can also be given per item
+    via ``set``.
+    """
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.items = OrderedDict()
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __getitem__(self, key):
+        """
+        Returns the item and marks it as most recently used, or raises
+        ``KeyError`` if it's missing or has expired.
+        """
+        value, expires = self.items.pop(key)
+        if expires is not None and expires <= time():
+            raise KeyError(key)
+        self.items[key] = (value, expires)
+        return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __delitem__(self, key):
+        del self.items[key]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def set(self, key, value, ttl=None):
+        """
+        Stores the item, discarding the least recently used items
+        if the cache is full.
+        """
+        if ttl is None:
+            ttl = self.ttl
+        expires = time() + ttl if ttl is not None else None
+        self.items.pop(key, None)
+        self.items[key] = (value, expires)
+        while len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
+
+    def pop(self, key, default=None):
+        try:
+            return self.items.pop(key)[0]
+        except KeyError:
+            return default
+
+    def keys(self):
+        """
+        Keys from least to most recently used.
+        """
+        return self.items.keys()
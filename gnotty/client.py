@@ -1,8 +1,17 @@
 
+from bisect import bisect_left, insort
+from collections import deque
+from heapq import heapify, heappop, heappush
+from itertools import count
 from logging import getLogger
 from hashlib import md5
+from socket import error as socket_error
+from time import time
+from uuid import uuid4
 
+from gevent import sleep, spawn, spawn_later
 from irc.client import SimpleIRCClient, ServerConnectionError
+from irc.client import ServerNotConnectedError
 
 from gnotty.conf import settings
 
@@ -18,6 +27,169 @@ def color(nickname):
     return "rgb(%s)" % ",".join([darken(_hex[i:i+2]) for i in range(6)[::2]])
 
 
+# Priorities for messages sent to the channel. Messages with a lower
+# priority value are sent first when messages are queued.
+PRIORITY_COMMAND = 0
+PRIORITY_DEFAULT = 1
+PRIORITY_COMMIT = 2
+PRIORITY_RSS = 3
+
+
+class MessageScheduler(object):
+    """
+    Paces the messages sent to the channel with a token bucket, so
+    that a burst of messages doesn't get the connection killed by the
+    IRC server for flooding. ``FLOOD_BURST`` messages can be sent at
+    once, after which messages are sent at ``FLOOD_RATE`` messages
+    per second. Queued messages are sent in order of priority, and
+    once more than ``FLOOD_MERGE`` messages are queued, bulk messages
+    (commits and RSS items) of the same priority are merged together
+    into as few messages as possible.
+    """
+
+    separator = " | "
+
+    def __init__(self, send):
+        self.send = send
+        self.tokens = settings.FLOOD_BURST
+        self.updated = time()
+        self.queue = []
+        self.counter = count()
+        self.greenlet = None
+        self.sent = 0
+        self.dropped = 0
+        self.total_latency = 0
+        self.max_latency = 0
+
+    def put(self, message, priority=PRIORITY_DEFAULT):
+        """
+        Queue a message, and start sending queued messages if
+        they're not already being sent.
+        """
+        heappush(self.queue, (priority, next(self.counter), time(), message))
+        if len(self.queue) > settings.FLOOD_MERGE:
+            self.merge()
+        if self.greenlet is None:
+            self.greenlet = spawn(self.run)
+
+    def merge(self):
+        """
+        Merge queued bulk messages of the same priority, keeping the
+        position and queue time of the first message in each merge.
+        """
+        bulk = {}
+        queue = []
+        for item in sorted(self.queue):
+            if item[0] >= PRIORITY_COMMIT:
+                bulk.setdefault(item[0], []).append(item)
+            else:
+                queue.append(item)
+        max_length = settings.MAX_MESSAGE_LENGTH
+        for items in bulk.values():
+            merged = list(items[0])
+            for item in items[1:]:
+                message = merged[3] + self.separator + item[3]
+                if len(message) <= max_length:
+                    merged[3] = message
+                else:
+                    queue.append(tuple(merged))
+                    merged = list(item)
+            queue.append(tuple(merged))
+        heapify(queue)
+        self.queue = queue
+
+    def run(self):
+        """
+        Send queued messages as tokens become available.
+        """
+        while self.queue:
+            now = time()
+            self.tokens = min(settings.FLOOD_BURST, self.tokens +
+                              (now - self.updated) * settings.FLOOD_RATE)
+            self.updated = now
+            if self.tokens < 1:
+                sleep((1 - self.tokens) / settings.FLOOD_RATE)
+                continue
+            self.tokens -= 1
+            priority, _, queued, message = heappop(self.queue)
+            try:
+                self.send(message)
+            except (socket_error, ServerNotConnectedError), e:
+                self.dropped += 1
+                getLogger("irc.dispatch").warning("Dropped message queued "
+                                                  "for %.2fs, not connected: "
+                                                  "%s" % (time() - queued, e))
+                continue
+            latency = time() - queued
+            self.sent += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            getLogger("irc.dispatch").debug("Message sent after %.2fs "
+                                            "queued" % latency)
+        self.greenlet = None
+
+    def stats(self):
+        """
+        Current length of the queue, the number of messages sent and
+        dropped, and latency of sent messages.
+        """
+        return {
+            "queued": len(self.queue),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "average_latency": self.total_latency / (self.sent or 1),
+            "max_latency": self.max_latency,
+        }
+
+
+class Roster(object):
+    """
+    Nicknames in the channel mapped to their colors. The nicknames
+    are kept sorted as they're added and removed, so that the sorted
+    list never needs to be rebuilt, and colors are only calculated
+    once per nickname.
+    """
+
+    def __init__(self):
+        self.colors = {}
+        self.sorted = []
+
+    def __len__(self):
+        return len(self.sorted)
+
+    def __contains__(self, nickname):
+        return nickname in self.colors
+
+    def __getitem__(self, nickname):
+        return self.colors[nickname]
+
+    def add(self, nickname):
+        """
+        Add a nickname if it's not already present, and return its
+        color.
+        """
+        if nickname not in self.colors:
+            self.colors[nickname] = color(nickname)
+            insort(self.sorted, nickname)
+        return self.colors[nickname]
+
+    def remove(self, nickname):
+        """
+        Remove a nickname and return its color.
+        """
+        nickname_color = self.colors.pop(nickname)
+        del self.sorted[bisect_left(self.sorted, nickname)]
+        return nickname_color
+
+    def as_list(self):
+        """
+        Sorted list of nicknames and their colors, in the format the
+        WebSocket expects.
+        """
+        return [{"nickname": name, "color": self.colors[name]}
+                for name in self.sorted]
+
+
 class BaseIRCClient(SimpleIRCClient, object):
     """
     Base class for IRC clients. Handles initial connection and
@@ -31,6 +203,7 @@ class BaseIRCClient(SimpleIRCClient, object):
         self.channel = channel
         self.nickname = nickname
         self.password = password or None
+        self.scheduler = MessageScheduler(self.send_message)
         self.reconnect()
 
     def reconnect(self):
@@ -80,26 +253,125 @@ class BaseIRCClient(SimpleIRCClient, object):
         self.nickname += str(digits)
         self.connect(self.host, self.port, self.nickname)
 
-    def message_channel(self, message):
+    def leave(self):
+        """
+        Disconnect from the IRC server with the project's quit message.
+        """
+        quit_message = "%s %s" % (settings.GNOTTY_VERSION_STRING,
+                                  settings.GNOTTY_PROJECT_URL)
+        self.connection.quit(quit_message)
+
+    def message_channel(self, message, priority=PRIORITY_DEFAULT):
         """
-        Nicer shortcut for sending a message to a channel. Also
-        irclib doesn't handle unicode so we bypass its
-        privmsg -> send_raw methods and use its socket directly.
+        Nicer shortcut for sending a message to a channel. Messages
+        are queued and paced by the scheduler, which sends queued
+        messages in order of priority.
         """
+        self.scheduler.put(message, priority)
+
+    def send_message(self, message):
+        """
+        Sends a message to the channel. irclib doesn't handle unicode
+        so we bypass its privmsg -> send_raw methods and use its
+        socket directly.
+        """
+        socket = getattr(self.connection, "socket", None)
+        if socket is None or not self.connection.is_connected():
+            raise ServerNotConnectedError("Not connected.")
         data = "PRIVMSG %s :%s\r\n" % (self.channel, message)
-        self.connection.socket.send(data.encode("utf-8"))
+        socket.send(data.encode("utf-8"))
 
 
 class WebSocketIRCClient(BaseIRCClient):
     """
     IRC client that's bridged with a gevent-socketio namespace.
+
+    The client can outlive its WebSocket - when the WebSocket goes
+    away, the client is detached from it and stays connected to the
+    IRC server for ``SESSION_GRACE`` seconds, keyed by its session
+    token. Events that occur while detached are stored in a bounded
+    buffer, and replayed when a WebSocket reattaches with the token.
     """
 
+    sessions = {}
+
+    # Prefixed to session tokens, so that when running several worker
+    # processes, the worker holding the session can be found.
+    token_prefix = ""
+
+    # Events that update the nicknames list. These aren't buffered
+    # while detached, since the entire list is sent on reattaching.
+    roster_events = ("nicknames", "nick_add", "nick_remove", "nick_rename")
+
     def __init__(self, host, port, channel, nickname, password, namespace):
-        self.nicknames = {}
+        self.nicknames = Roster()
         self.namespace = namespace
+        self.token = self.token_prefix + uuid4().hex
+        self.missed = deque(maxlen=settings.SESSION_BUFFER)
+        self.expiry = None
+        self.greenlet = None
         client_args = (host, port, channel, nickname, password)
         super(WebSocketIRCClient, self).__init__(*client_args)
+        if namespace is not None:
+            self.sessions[self.token] = self
+            self.emit("session", self.token)
+
+    def run(self):
+        """
+        Start the client in a greenlet of its own, rather than one
+        belonging to the namespace, so that it can outlive it.
+        """
+        self.greenlet = spawn(self.start)
+
+    def leave(self):
+        """
+        Disconnect from the IRC server, and stop the client's greenlet.
+        """
+        self.sessions.pop(self.token, None)
+        if self.connection.connected:
+            super(WebSocketIRCClient, self).leave()
+        if self.greenlet is not None:
+            self.greenlet.kill(block=False)
+
+    def attach(self, namespace):
+        """
+        A WebSocket has resumed the session - cancel the pending
+        disconnect, bring the WebSocket up to date, and replay any
+        events it missed.
+        """
+        if self.expiry is not None:
+            self.expiry.kill()
+            self.expiry = None
+        self.namespace = namespace
+        self.emit("session", self.token)
+        self.emit("join")
+        while self.missed:
+            self.emit(*self.missed.popleft())
+        self.emit_nicknames()
+
+    def detach(self, namespace):
+        """
+        The WebSocket went away - stay connected to the IRC server for
+        the grace period, in case the WebSocket comes back. Ignored if
+        the session has since been resumed by another WebSocket.
+        """
+        if namespace is not self.namespace:
+            return
+        self.namespace = None
+        if settings.SESSION_GRACE > 0:
+            self.expiry = spawn_later(settings.SESSION_GRACE, self.leave)
+        else:
+            self.leave()
+
+    def emit(self, event, *args):
+        """
+        Send an event to the WebSocket, or buffer it if detached.
+        """
+        if self.namespace is None:
+            if event not in self.roster_events:
+                self.missed.append((event,) + args)
+        else:
+            self.namespace.emit(event, *args)
 
     def emit_message(self, message):
         """
@@ -117,22 +389,28 @@ class WebSocketIRCClient(BaseIRCClient):
             self.connection.send_raw(message.lstrip("/"))
             return
         self.message_channel(message)
-        self.namespace.emit("message", self.nickname, message, nickname_color)
+        self.emit("message", self.nickname, message, nickname_color)
 
     def emit_nicknames(self):
         """
-        Send the nickname list to the Websocket. Called whenever the
-        nicknames list changes.
+        Send the entire nickname list to the Websocket. Only called
+        when first joining, after which changes to the list are sent
+        as they occur.
+        """
+        self.emit("nicknames", self.nicknames.as_list())
+
+    def on_disconnect(self, connection, event):
+        """
+        Lost the connection to the IRC server - the session can no
+        longer be resumed.
         """
-        nicknames = [{"nickname": name, "color": color(name)}
-                     for name in sorted(self.nicknames.keys())]
-        self.namespace.emit("nicknames", nicknames)
+        self.sessions.pop(self.token, None)
 
     def on_erroneusnickname(self, connection, event):
         """
         Invalid nickname chars/length - report back to the client.
         """
-        self.namespace.emit("invalid")
+        self.emit("invalid")
 
     def on_namreply(self, connection, event):
         """
@@ -140,49 +418,45 @@ class WebSocketIRCClient(BaseIRCClient):
         and send the list to the WebSocket.
         """
         for nickname in event.arguments()[-1].split():
-            nickname = nickname.lstrip("@+")
-            self.nicknames[nickname] = color(nickname)
+            self.nicknames.add(nickname.lstrip("@+"))
         self.emit_nicknames()
 
     def on_join(self, connection, event):
         """
-        Someone joined the channel - send the nicknames list to the
+        Someone joined the channel - send the new nickname to the
         WebSocket.
         """
         #from time import sleep; sleep(10)  # Simulate a slow connection
         nickname = self.get_nickname(event)
-        nickname_color = color(nickname)
-        self.nicknames[nickname] = nickname_color
-        self.namespace.emit("join")
-        self.namespace.emit("message", nickname, "joins", nickname_color)
-        self.emit_nicknames()
+        nickname_color = self.nicknames.add(nickname)
+        self.emit("join")
+        self.emit("message", nickname, "joins", nickname_color)
+        self.emit("nick_add", nickname, nickname_color)
 
     def on_nick(self, connection, event):
         """
-        Someone changed their nickname - send the nicknames list to the
-        WebSocket.
+        Someone changed their nickname - send the old and new
+        nicknames to the WebSocket.
         """
         old_nickname = self.get_nickname(event)
-        old_color = self.nicknames.pop(old_nickname)
+        old_color = self.nicknames.remove(old_nickname)
         new_nickname = event.target()
         message = "is now known as %s" % new_nickname
-        self.namespace.emit("message", old_nickname, message, old_color)
-        new_color = color(new_nickname)
-        self.nicknames[new_nickname] = new_color
-        self.emit_nicknames()
+        self.emit("message", old_nickname, message, old_color)
+        new_color = self.nicknames.add(new_nickname)
+        self.emit("nick_rename", old_nickname, new_nickname, new_color)
         if self.nickname == old_nickname:
             self.nickname = new_nickname
 
     def on_quit(self, connection, event):
         """
-        Someone left the channel - send the nicknames list to the
+        Someone left the channel - send the nickname to remove to the
         WebSocket.
         """
         nickname = self.get_nickname(event)
-        nickname_color = self.nicknames[nickname]
-        del self.nicknames[nickname]
-        self.namespace.emit("message", nickname, "leaves", nickname_color)
-        self.emit_nicknames()
+        nickname_color = self.nicknames.remove(nickname)
+        self.emit("message", nickname, "leaves", nickname_color)
+        self.emit("nick_remove", nickname)
 
     def on_pubmsg(self, connection, event):
         """
@@ -191,4 +465,115 @@ class WebSocketIRCClient(BaseIRCClient):
         for message in event.arguments():
             nickname = self.get_nickname(event)
             nickname_color = self.nicknames[nickname]
-            self.namespace.emit("message", nickname, message, nickname_color)
+            self.emit("message", nickname, message, nickname_color)
+
+
+class SpectatorIRCClient(WebSocketIRCClient):
+    """
+    Read-only IRC client shared by every WebSocket namespace that is
+    spectating the same channel, so that anonymous visitors don't
+    each require their own connection to the IRC server. A single
+    listener is kept per host/port/channel, and its channel events
+    are fanned out to all of its namespaces.
+    """
+
+    listeners = {}
+
+    def __init__(self, host, port, channel):
+        self.key = (host, str(port), channel)
+        self.namespaces = set()
+        self.nicknames = Roster()
+        # Connecting yields to other greenlets, so the listener is
+        # stored before connecting, for spectators arriving in the
+        # meantime to share it rather than creating their own.
+        self.listeners[self.key] = self
+        client_args = (host, port, channel, settings.SPECTATOR_NICKNAME,
+                       None, None)
+        try:
+            super(SpectatorIRCClient, self).__init__(*client_args)
+        except:
+            if self.listeners.get(self.key) is self:
+                del self.listeners[self.key]
+            raise
+
+    @classmethod
+    def subscribe(cls, host, port, channel, namespace):
+        """
+        Add a namespace to the listener for the given channel,
+        creating and starting the listener if it doesn't exist yet.
+        """
+        key = (host, str(port), channel)
+        listener = cls.listeners.get(key)
+        if listener is None:
+            listener = cls(host, port, channel)
+            listener.run()
+            if not listener.connection.connected:
+                spawn(listener.reconnect_while_listening)
+        elif listener.nicknames:
+            # Late arrivals missed the initial nicknames list.
+            namespace.emit("nicknames", listener.nickname_list())
+        listener.namespaces.add(namespace)
+        return listener
+
+    def unsubscribe(self, namespace):
+        """
+        Remove a namespace from the listener, and disconnect from the
+        IRC server once no namespaces remain.
+        """
+        self.namespaces.discard(namespace)
+        if not self.namespaces and self.listeners.get(self.key) is self:
+            del self.listeners[self.key]
+            self.leave()
+
+    def reconnect_while_listening(self):
+        """
+        Reconnect to the IRC server, backing off between attempts,
+        until connected or no longer the channel's listener.
+        """
+        interval = 1
+        while self.listeners.get(self.key) is self:
+            self.nicknames = Roster()
+            if self.reconnect():
+                break
+            sleep(interval)
+            interval = min(interval * 2, 60)
+
+    def on_disconnect(self, connection, event):
+        """
+        Lost the connection to the IRC server - reconnect if there are
+        still spectators, otherwise the listener has already been
+        removed by ``unsubscribe``.
+        """
+        if self.listeners.get(self.key) is self:
+            spawn(self.reconnect_while_listening)
+
+    def nickname_list(self):
+        """
+        Nicknames in the channel, without the listener's own.
+        """
+        return [nickname for nickname in self.nicknames.as_list()
+                if nickname["nickname"] != self.nickname]
+
+    def emit_nicknames(self):
+        self.emit("nicknames", self.nickname_list())
+
+    def emit(self, event, *args):
+        """
+        Fan the event out to every spectating namespace. The join and
+        invalid events are specific to a user's own connection, so
+        they're not sent to spectators, and neither are events for
+        the listener's own nickname.
+        """
+        if event in ("join", "invalid"):
+            return
+        own_events = ("message", "nick_add", "nick_remove")
+        if event in own_events and args and args[0] == self.nickname:
+            return
+        for namespace in list(self.namespaces):
+            namespace.emit(event, *args)
+
+    def emit_message(self, message):
+        """
+        Spectators can't send messages.
+        """
+        return
@@ -38,9 +38,107 @@ options.add_option("-n", "--bot-nickname", dest="BOT_NICKNAME",
 options.add_option("-x", "--bot-password", dest="BOT_PASSWORD",
                   metavar="PASSWORD", default="",
                   help="Optional IRC password for the bot")
+options.add_option("--spectator-nickname", dest="SPECTATOR_NICKNAME",
+                  metavar="NICKNAME", default="gnotty-web",
+                  help="IRC nickname for the shared connection used by "
+                       "read-only visitors [default: %default]")
+options.add_option("--session-grace", dest="SESSION_GRACE",
+                  metavar="SECONDS", default=60, type=int,
+                  help="Seconds to keep a user's IRC connection open after "
+                       "their browser disconnects, so that the session can "
+                       "be resumed [default: %default]")
+options.add_option("--session-buffer", dest="SESSION_BUFFER",
+                  metavar="EVENTS", default=200, type=int,
+                  help="Maximum number of missed events replayed when a "
+                       "session is resumed [default: %default]")
+options.add_option("--batch-window", dest="BATCH_WINDOW",
+                  metavar="MILLISECONDS", default=50, type=int,
+                  help="Time to collect events for before sending them to "
+                       "the browser together, 0 to disable batching "
+                       "[default: %default]")
+options.add_option("--batch-size", dest="BATCH_SIZE", metavar="EVENTS",
+                  default=100, type=int,
+                  help="Maximum number of events to send to the browser "
+                       "together [default: %default]")
+options.add_option("--queue-size", dest="QUEUE_SIZE", metavar="EVENTS",
+                  default=1000, type=int,
+                  help="Maximum number of events to hold for a browser that "
+                       "hasn't received previous events yet [default: "
+                       "%default]")
+options.add_option("--queue-overflow", dest="QUEUE_OVERFLOW",
+                  metavar="drop|skip|disconnect",
+                  choices=("drop", "skip", "disconnect"), default="skip",
+                  help="What to do when a browser's queue of events is full "
+                       "[default: %default]")
+options.add_option("--flood-burst", dest="FLOOD_BURST", metavar="MESSAGES",
+                  default=5, type=int,
+                  help="Number of messages that can be sent to the IRC "
+                       "channel at once [default: %default]")
+options.add_option("--flood-rate", dest="FLOOD_RATE", metavar="MESSAGES",
+                  default=0.5, type=float,
+                  help="Messages per second sent to the IRC channel once the "
+                       "burst is used up [default: %default]")
+options.add_option("--flood-merge", dest="FLOOD_MERGE", metavar="MESSAGES",
+                  default=10, type=int,
+                  help="Number of queued messages after which bot messages "
+                       "such as commits are merged together [default: "
+                       "%default]")
+options.add_option("--handler-pool-size", dest="HANDLER_POOL_SIZE",
+                  metavar="HANDLERS", default=20, type=int,
+                  help="Maximum number of I/O bound bot event handlers "
+                       "running at once [default: %default]")
+options.add_option("--handler-processes", dest="HANDLER_PROCESSES",
+                  metavar="PROCESSES", default=2, type=int,
+                  help="Number of worker processes for CPU bound bot work "
+                       "[default: %default]")
+options.add_option("--handler-queue-size", dest="HANDLER_QUEUE_SIZE",
+                  metavar="EVENTS", default=100, type=int,
+                  help="Maximum number of events waiting for I/O or CPU "
+                       "bound bot event handlers, after which further "
+                       "events are dropped [default: %default]")
 options.add_option("-L", "--login-required", dest="LOGIN_REQUIRED",
                   action="store_true", default=False,
                   help="Django login required for all URLs (Django only)")
+options.add_option("--auth-cache-ttl", dest="AUTH_CACHE_TTL",
+                  metavar="SECONDS", default=60, type=int,
+                  help="Seconds to cache each session's login check for "
+                       "(Django only) [default: %default]")
+options.add_option("--auth-cache-size", dest="AUTH_CACHE_SIZE",
+                  metavar="SESSIONS", default=10000, type=int,
+                  help="Maximum number of sessions to cache login checks "
+                       "for (Django only) [default: %default]")
+options.add_option("--log-batch-size", dest="LOG_BATCH_SIZE",
+                  metavar="MESSAGES", default=100, type=int,
+                  help="Number of IRC messages to save to the database "
+                       "together (Django only) [default: %default]")
+options.add_option("--log-batch-interval", dest="LOG_BATCH_INTERVAL",
+                  metavar="SECONDS", default=1, type=float,
+                  help="Maximum seconds to wait before saving IRC messages "
+                       "to the database (Django only) [default: %default]")
+options.add_option("--log-queue-size", dest="LOG_QUEUE_SIZE",
+                  metavar="MESSAGES", default=10000, type=int,
+                  help="Maximum number of IRC messages waiting to be saved "
+                       "to the database (Django only) [default: %default]")
+options.add_option("--search-backend", dest="SEARCH_BACKEND",
+                  metavar="auto|sqlite|postgresql|contains",
+                  choices=("auto", "sqlite", "postgresql", "contains"),
+                  default="auto",
+                  help="Backend used to search the message archive "
+                       "(Django only) [default: %default]")
+options.add_option("--page-size", dest="PAGE_SIZE", metavar="MESSAGES",
+                  default=500, type=int,
+                  help="Number of messages shown per page in the archive "
+                       "(Django only) [default: %default]")
+options.add_option("--day-cache-ttl", dest="DAY_CACHE_TTL",
+                  metavar="SECONDS", default=60, type=int,
+                  help="Seconds to cache the archive page for the current "
+                       "day for (Django only) [default: %default]")
+options.add_option("--archive-dir", dest="ARCHIVE_DIR", metavar="DIR_PATH",
+                  help="Directory for messages moved out of the database by "
+                       "the gnotty_archive command (Django only)")
+options.add_option("--workers", dest="WORKERS", metavar="WORKERS",
+                  default=1, type=int,
+                  help="Number of worker processes to run [default: %default]")
 options.add_option("-D", "--daemon", dest="DAEMON", action="store_true",
                   default=False,
                   help="run in daemon mode")
@@ -0,0 +1,233 @@
+
+from datetime import datetime
+from json import dumps, loads
+from re import compile, search
+from time import time
+
+from django.conf import settings as django_settings
+from django.db.models import Q
+from django.utils.timezone import is_aware, localtime, make_aware
+from django.utils.timezone import get_current_timezone
+
+from gnotty.archive import dict_to_message, message_to_dict
+from gnotty.models import IRCMessage
+
+
+IRSSI_DAY = compile(r"^--- (?:Log opened|Day changed) (.+)$")
+IRSSI_LINE = compile(r"^(\d{2}):(\d{2})(?::(\d{2}))? (.*)$")
+IRSSI_MESSAGE = compile(r"^<[ @+%&~]?([^>]+)> (.*)$")
+IRSSI_JOIN = compile(r"^-!- (\S+) \[[^\]]*\] has joined ")
+IRSSI_LEAVE = compile(r"^-!- (\S+) \[[^\]]*\] has (?:quit|left) ")
+IRSSI_NICK = compile(r"^-!- (\S+) (is now known as \S+)$")
+
+ZNC_LINE = compile(r"^\[(\d{2}):(\d{2}):(\d{2})\] (.*)$")
+ZNC_MESSAGE = compile(r"^<([^>]+)> (.*)$")
+ZNC_JOIN = compile(r"^\*\*\* Joins: (\S+)")
+ZNC_LEAVE = compile(r"^\*\*\* (?:Quits|Parts): (\S+)")
+ZNC_NICK = compile(r"^\*\*\* (\S+) (is now known as \S+)$")
+
+
+class Progress(object):
+    """
+    Writes the number of messages processed and the rate they're
+    processed at, every ``every`` messages.
+    """
+
+    def __init__(self, stream, every):
+        self.stream = stream
+        self.every = every
+        self.start = time()
+        self.count = 0
+        self.reported = 0
+
+    def update(self, count):
+        self.count += count
+        if self.count - self.reported >= self.every:
+            self.report()
+
+    def counted(self, messages):
+        """
+        Yields the messages, updating the count for each one.
+        """
+        for message in messages:
+            yield message
+            self.update(1)
+
+    def report(self):
+        self.reported = self.count
+        rate = self.count / max(time() - self.start, 0.001)
+        self.stream.write("%s messages, %d messages/sec\n" %
+                          (self.count, rate))
+
+
+def chunked(messages, size):
+    """
+    Yields the messages ordered by time then ID, fetching them a chunk
+    at a time from where the previous chunk ended, so that memory use
+    doesn't grow with the number of messages.
+    """
+    last = None
+    while True:
+        chunk = messages
+        if last is not None:
+            chunk = chunk.filter(Q(message_time__gt=last.message_time) |
+                                 Q(message_time=last.message_time,
+                                   id__gt=last.id))
+        chunk = list(chunk.order_by("message_time", "id")[:size])
+        if not chunk:
+            break
+        for message in chunk:
+            yield message
+        last = chunk[-1]
+
+
+def local_time(day, hour, minute, second):
+    """
+    Time for a line in a text log, which are in local time.
+    """
+    message_time = datetime(day.year, day.month, day.day, int(hour),
+                            int(minute), int(second or 0))
+    if django_settings.USE_TZ:
+        message_time = make_aware(message_time, get_current_timezone())
+    return message_time
+
+
+def parse_line(body, patterns):
+    """
+    Returns the nickname, message and join/leave flag for the body of
+    a line in a text log, or None for lines that aren't messages.
+    """
+    message, join, leave, nick = patterns
+    match = message.match(body)
+    if match:
+        return match.group(1), match.group(2), False
+    match = join.match(body)
+    if match:
+        return match.group(1), "joins", True
+    match = leave.match(body)
+    if match:
+        return match.group(1), "leaves", True
+    match = nick.match(body)
+    if match:
+        return match.group(1), match.group(2), False
+
+
+def read_jsonl(lines, **options):
+    """
+    Reads messages exported with ``write_jsonl``. Message IDs aren't
+    kept, so that they don't clash with existing messages. The
+    rendered HTML and nickname color are dropped rather than trusted
+    from the file, so that they're rendered again.
+    """
+    for line in lines:
+        if line.strip():
+            data = loads(line)
+            data.pop("message_html", None)
+            data.pop("nickname_color", None)
+            message = dict_to_message(data)
+            message.id = None
+            yield message
+
+
+def read_irssi(lines, server, channel, **options):
+    """
+    Reads an irssi log, which contains lines for the day changing.
+    """
+    patterns = (IRSSI_MESSAGE, IRSSI_JOIN, IRSSI_LEAVE, IRSSI_NICK)
+    day = None
+    for line in lines:
+        line = line.decode("utf-8", "replace").rstrip("\r\n")
+        match = IRSSI_DAY.match(line)
+        if match:
+            for format in ("%a %b %d %H:%M:%S %Y", "%a %b %d %Y"):
+                try:
+                    day = datetime.strptime(match.group(1), format).date()
+                except ValueError:
+                    pass
+            continue
+        match = IRSSI_LINE.match(line)
+        if not match or day is None:
+            continue
+        parsed = parse_line(match.group(4), patterns)
+        if parsed:
+            nickname, message, join_or_leave = parsed
+            message_time = local_time(day, *match.groups()[:3])
+            yield IRCMessage(server=server, channel=channel,
+                             nickname=nickname, message=message,
+                             join_or_leave=join_or_leave,
+                             message_time=message_time)
+
+
+def read_znc(lines, server, channel, path=None, day=None, **options):
+    """
+    Reads a ZNC log, which contains a single day given either by the
+    ``day`` arg, or the date in the log's file name.
+    """
+    if day is None:
+        match = search(r"(\d{4})-?(\d{2})-?(\d{2})", path or "")
+        if not match:
+            raise ValueError("The date couldn't be determined from the "
+                             "file name %s" % path)
+        day = datetime(*map(int, match.groups())).date()
+    patterns = (ZNC_MESSAGE, ZNC_JOIN, ZNC_LEAVE, ZNC_NICK)
+    for line in lines:
+        line = line.decode("utf-8", "replace").rstrip("\r\n")
+        match = ZNC_LINE.match(line)
+        if not match:
+            continue
+        parsed = parse_line(match.group(4), patterns)
+        if parsed:
+            nickname, message, join_or_leave = parsed
+            message_time = local_time(day, *match.groups()[:3])
+            yield IRCMessage(server=server, channel=channel,
+                             nickname=nickname, message=message,
+                             join_or_leave=join_or_leave,
+                             message_time=message_time)
+
+
+def write_jsonl(messages):
+    """
+    Yields a line of JSON for each message.
+    """
+    for message in messages:
+        yield dumps(message_to_dict(message)) + "\n"
+
+
+def write_irssi(messages):
+    """
+    Yields the lines of an irssi log for the messages.
+    """
+    day = None
+    for message in messages:
+        message_time = message.message_time
+        if is_aware(message_time):
+            message_time = localtime(message_time)
+        if day is None:
+            yield message_time.strftime("--- Log opened %a %b %d "
+                                        "%H:%M:%S %Y\n")
+        elif message_time.date() != day:
+            yield message_time.strftime("--- Day changed %a %b %d %Y\n")
+        day = message_time.date()
+        host = "%s@%s" % (message.nickname, message.server)
+        if message.join_or_leave and message.message == "joins":
+            line = "-!- %s [%s] has joined %s" % (message.nickname, host,
+                                                   message.channel)
+        elif message.join_or_leave:
+            line = "-!- %s [%s] has quit [%s]" % (message.nickname, host,
+                                                  message.message)
+        else:
+            line = "<%s> %s" % (message.nickname, message.message)
+        line = "%s %s\n" % (message_time.strftime("%H:%M:%S"), line)
+        yield line.encode("utf-8")
+
+
+readers = {
+    "jsonl": read_jsonl,
+    "irssi": read_irssi,
+    "znc": read_znc,
+}
+
+writers = {
+    "jsonl": write_jsonl,
+    "irssi": write_irssi,
+}
@@ -2,24 +2,132 @@
 from gevent.monkey import patch_all
 patch_all()
 
+from collections import deque
+from datetime import datetime
 from logging import getLogger, StreamHandler
+import os
+import signal
+import sys
+from time import time
 
+from django.conf import settings as django_settings
 from django.core.management.base import BaseCommand
+from django.utils.timezone import utc
+from gevent import get_hub, spawn
+from gevent.event import Event
 
 from gnotty.conf import settings
-from gnotty.models import IRCMessage
+from gnotty.models import DailyActivity, IRCMessage
 
 
 class ModelLogger(StreamHandler):
     """
-    Logging handler that saves an IRC message to the DB.
+    Logging handler that saves IRC messages to the DB. Messages are
+    queued and written together with ``bulk_create`` in a thread,
+    once ``LOG_BATCH_SIZE`` messages are queued or every
+    ``LOG_BATCH_INTERVAL`` seconds, so that the gevent loop isn't
+    blocked waiting on the DB for each message.
     """
+
+    def __init__(self):
+        StreamHandler.__init__(self)
+        self.queue = deque()
+        self.wake = Event()
+        self.writer = None
+        self.pid = None
+        self.written = 0
+        self.dropped = 0
+        self.writes = 0
+        self.total_write_time = 0
+        self.max_write_time = 0
+
     def emit(self, record):
-        IRCMessage.objects.create(server=record.server,
-                                  channel=record.channel,
-                                  nickname=record.nickname,
-                                  message=record.msg,
-                                  join_or_leave=record.join_or_leave)
+        if len(self.queue) >= settings.LOG_QUEUE_SIZE:
+            self.dropped += 1
+            return
+        if django_settings.USE_TZ:
+            message_time = datetime.utcfromtimestamp(record.created)
+            message_time = message_time.replace(tzinfo=utc)
+        else:
+            message_time = datetime.fromtimestamp(record.created)
+        self.queue.append(IRCMessage(server=record.server,
+                                     channel=record.channel,
+                                     nickname=record.nickname,
+                                     message=record.msg,
+                                     join_or_leave=record.join_or_leave,
+                                     message_time=message_time))
+        # Start the writer in whichever process the bot runs in,
+        # which may be a forked worker process.
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.writer = spawn(self.run)
+        if len(self.queue) >= settings.LOG_BATCH_SIZE:
+            self.wake.set()
+
+    def run(self):
+        """
+        Writes queued messages in a thread, whenever a batch is
+        ready or the interval passes.
+        """
+        while True:
+            self.wake.wait(settings.LOG_BATCH_INTERVAL)
+            self.wake.clear()
+            while self.queue:
+                get_hub().threadpool.apply(self.write)
+
+    def write(self):
+        """
+        Writes the next batch of queued messages.
+        """
+        batch = []
+        while self.queue and len(batch) < settings.LOG_BATCH_SIZE:
+            batch.append(self.queue.popleft())
+        if not batch:
+            return
+        start = time()
+        try:
+            for message in batch:
+                message.render()
+            IRCMessage.objects.bulk_create(batch)
+        except Exception, e:
+            getLogger("irc.dispatch").error("Couldn't save %s messages: %s"
+                                            % (len(batch), e))
+            return
+        try:
+            DailyActivity.add(batch)
+        except Exception, e:
+            getLogger("irc.dispatch").error("Couldn't update the daily "
+                                            "counts for %s messages, run "
+                                            "gnotty_rollup to rebuild them: "
+                                            "%s" % (len(batch), e))
+        write_time = time() - start
+        self.written += len(batch)
+        self.writes += 1
+        self.total_write_time += write_time
+        self.max_write_time = max(self.max_write_time, write_time)
+        getLogger("irc.dispatch").debug("Saved %s messages in %.3fs, %s "
+                                        "queued" % (len(batch), write_time,
+                                                    len(self.queue)))
+
+    def flush(self):
+        """
+        Writes all queued messages immediately. Called when gnottify
+        exits, and by logging when a worker process shuts it down.
+        """
+        while self.queue:
+            self.write()
+
+    def stats(self):
+        """
+        Current length of the queue, and time taken writing messages.
+        """
+        return {
+            "queued": len(self.queue),
+            "written": self.written,
+            "dropped": self.dropped,
+            "average_write_time": self.total_write_time / (self.writes or 1),
+            "max_write_time": self.max_write_time,
+        }
 
 
 class Command(BaseCommand):
@@ -27,7 +135,15 @@ class Command(BaseCommand):
     option_list = BaseCommand.option_list + tuple(settings.option_list)
 
     def handle(self, *args, **options):
-        getLogger("irc.message").addHandler(ModelLogger())
+        model_logger = ModelLogger()
+        getLogger("irc.message").addHandler(model_logger)
         settings.parse_args()
+        # Exit normally on SIGTERM so that any messages still queued
+        # are saved. Worker processes replace this with their own
+        # handler, and flush the logger when they shut down logging.
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
         from gnotty.server import serve_forever
-        serve_forever(django=True)
+        try:
+            serve_forever(django=True)
+        finally:
+            model_logger.flush()
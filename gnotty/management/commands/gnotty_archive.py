@@ -0,0 +1,53 @@
+
+from datetime import date, timedelta
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gnotty.archive import write_segment
+from gnotty.conf import settings
+from gnotty.models import DailyActivity, IRCMessage
+from gnotty.views import clear_day_cache, date_range
+
+
+class Command(BaseCommand):
+    """
+    Moves messages for days older than the given number of months out
+    of the database, into a compressed segment file per channel per
+    day under ``ARCHIVE_DIR``. The daily message counts are kept, so
+    the archive calendar still shows archived days.
+    """
+
+    help = "Moves old messages out of the database into ARCHIVE_DIR"
+
+    option_list = BaseCommand.option_list + (
+        make_option("--months", dest="months", type=int, default=12,
+                    help="Archive days older than this many months "
+                         "[default: %default]"),
+    )
+
+    def handle(self, *args, **options):
+        if not settings.ARCHIVE_DIR:
+            raise CommandError("The ARCHIVE_DIR setting isn't set")
+        today = date.today()
+        month = today.year * 12 + today.month - 1 - options["months"]
+        cutoff = date(month // 12, month % 12 + 1, 1)
+        days = DailyActivity.objects.filter(day__lt=cutoff)
+        total = 0
+        for channel, day in days.values_list("channel", "day"):
+            messages = IRCMessage.objects.filter(channel=channel,
+                **date_range(day, day + timedelta(days=1)))
+            archive = list(messages.order_by("message_time", "id"))
+            if not archive:
+                continue
+            write_segment(channel, day, archive)
+            # Deleted by ID, since messages logged or imported while
+            # archiving may fall anywhere in the day's order.
+            ids = [message.id for message in archive]
+            for i in range(0, len(ids), 500):
+                IRCMessage.objects.filter(id__in=ids[i:i + 500]).delete()
+            total += len(archive)
+            print "Archived %s messages for %s on %s" % (len(archive),
+                                                         channel, day)
+        clear_day_cache()
+        print "Archived %s messages older than %s" % (total, cutoff)
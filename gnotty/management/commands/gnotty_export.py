@@ -0,0 +1,52 @@
+
+from gzip import GzipFile
+from optparse import make_option
+import sys
+
+from django.core.management.base import BaseCommand
+
+from gnotty.logs import chunked, Progress, writers
+from gnotty.models import IRCMessage
+
+
+class Command(BaseCommand):
+    """
+    Writes logged messages to a file or stdout, either as JSON lines
+    that can be loaded with ``gnotty_import``, or as an irssi log.
+    """
+
+    args = "[file_path]"
+    help = "Exports logged messages as JSON lines or an irssi log"
+
+    option_list = BaseCommand.option_list + (
+        make_option("--format", dest="format", default="jsonl",
+                    choices=sorted(writers.keys()),
+                    help="Format to export [default: %default]"),
+        make_option("--channel", dest="channel",
+                    help="Only export messages for this channel"),
+        make_option("--batch-size", dest="batch_size", type=int,
+                    default=1000,
+                    help="Number of messages to read from the database at "
+                         "once [default: %default]"),
+    )
+
+    def handle(self, path="-", *args, **options):
+        messages = IRCMessage.objects.all()
+        if options["channel"]:
+            messages = messages.filter(channel=options["channel"])
+        if path == "-":
+            output = sys.stdout
+        elif path.endswith(".gz"):
+            output = GzipFile(path, "wb")
+        else:
+            output = open(path, "wb")
+        progress = Progress(sys.stderr, options["batch_size"] * 10)
+        write = writers[options["format"]]
+        messages = progress.counted(chunked(messages, options["batch_size"]))
+        try:
+            for line in write(messages):
+                output.write(line)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        progress.report()
@@ -0,0 +1,96 @@
+
+from datetime import datetime
+from gzip import GzipFile
+from optparse import make_option
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gnotty.conf import settings
+from gnotty.logs import Progress, readers
+from gnotty.models import DailyActivity, IRCMessage, atomic
+from gnotty.views import clear_day_cache
+
+
+class Command(BaseCommand):
+    """
+    Loads messages from JSON lines exported with ``gnotty_export``, or
+    from irssi or ZNC logs. Messages are saved in batches, each along
+    with its daily message counts in a single transaction, so that the
+    counts match the messages saved if the import fails partway.
+    """
+
+    args = "file_path [file_path ...]"
+    help = "Imports messages from JSON lines, irssi or ZNC logs"
+
+    option_list = BaseCommand.option_list + (
+        make_option("--format", dest="format", default="jsonl",
+                    choices=sorted(readers.keys()),
+                    help="Format of the files to import [default: %default]"),
+        make_option("--server", dest="server", default=settings.IRC_HOST,
+                    help="IRC server for messages in irssi and ZNC logs "
+                         "[default: %default]"),
+        make_option("--channel", dest="channel",
+                    default=settings.IRC_CHANNEL,
+                    help="IRC channel for messages in irssi and ZNC logs "
+                         "[default: %default]"),
+        make_option("--date", dest="date",
+                    help="Date of the messages in ZNC logs, as YYYY-MM-DD, "
+                         "if not given in their file names"),
+        make_option("--batch-size", dest="batch_size", type=int,
+                    default=1000,
+                    help="Number of messages to save to the database at "
+                         "once [default: %default]"),
+    )
+
+    def handle(self, *paths, **options):
+        if not paths:
+            raise CommandError("At least one file to import is required")
+        day = options["date"]
+        if day:
+            day = datetime.strptime(day, "%Y-%m-%d").date()
+        read = readers[options["format"]]
+        batch_size = options["batch_size"]
+        progress = Progress(sys.stderr, batch_size * 10)
+        try:
+            for path in paths:
+                self.load(path, read, batch_size, progress, options, day)
+        finally:
+            clear_day_cache()
+            progress.report()
+
+    def load(self, path, read, batch_size, progress, options, day):
+        """
+        Saves the messages in a file, a batch at a time.
+        """
+        if path.endswith(".gz"):
+            lines = GzipFile(path, "rb")
+        else:
+            lines = open(path, "rb")
+        messages = read(lines, server=options["server"],
+                        channel=options["channel"], path=path, day=day)
+        batch = []
+        try:
+            for message in messages:
+                batch.append(message)
+                if len(batch) == batch_size:
+                    self.save(batch)
+                    progress.update(len(batch))
+                    batch = []
+        except ValueError, e:
+            raise CommandError(e)
+        finally:
+            lines.close()
+        if batch:
+            self.save(batch)
+            progress.update(len(batch))
+
+    def save(self, batch):
+        """
+        Saves a batch of messages and adds them to the daily counts.
+        """
+        for message in batch:
+            message.render()
+        with atomic():
+            IRCMessage.objects.bulk_create(batch)
+            DailyActivity.add(batch)
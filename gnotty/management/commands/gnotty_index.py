@@ -0,0 +1,24 @@
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from gnotty.search import backends
+
+
+class Command(BaseCommand):
+    """
+    Creates the full-text search index for the database in use, and
+    adds all existing messages to it.
+    """
+
+    help = "Creates the full-text search index for the message archive"
+
+    def handle(self, *args, **options):
+        try:
+            backend = backends[connection.vendor]()
+        except KeyError:
+            raise CommandError("Full-text search isn't supported for %s"
+                               % connection.vendor)
+        backend.install()
+        backend.backfill()
+        print "Created %s search index" % connection.vendor
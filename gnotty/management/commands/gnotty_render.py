@@ -0,0 +1,94 @@
+
+from datetime import timedelta
+from optparse import make_option
+import sys
+from time import time
+
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+from django.utils.timezone import now
+
+from gnotty.logs import chunked, Progress
+from gnotty.models import IRCMessage, atomic
+from gnotty.views import clear_day_cache
+
+
+class Command(BaseCommand):
+    """
+    Stores the rendered HTML and nickname color for messages logged
+    before they were stored when logging. With ``--benchmark``, times
+    rendering a day of messages in the archive with and without the
+    stored HTML instead.
+    """
+
+    help = "Stores the rendered HTML for previously logged messages"
+
+    option_list = BaseCommand.option_list + (
+        make_option("--all", dest="all", action="store_true",
+                    default=False,
+                    help="Render all messages, not only those without HTML"),
+        make_option("--batch-size", dest="batch_size", type=int,
+                    default=1000,
+                    help="Number of messages to save at once "
+                         "[default: %default]"),
+        make_option("--benchmark", dest="benchmark", action="store_true",
+                    default=False,
+                    help="Time rendering 10,000 messages with and without "
+                         "stored HTML, without changing any messages"),
+    )
+
+    def handle(self, *args, **options):
+        if options["benchmark"]:
+            self.benchmark()
+            return
+        messages = IRCMessage.objects.all()
+        if not options["all"]:
+            messages = messages.filter(message_html="")
+        progress = Progress(sys.stderr, options["batch_size"] * 10)
+        batch = []
+        for message in chunked(messages, options["batch_size"]):
+            batch.append(message)
+            if len(batch) == options["batch_size"]:
+                self.save(batch)
+                progress.update(len(batch))
+                batch = []
+        if batch:
+            self.save(batch)
+            progress.update(len(batch))
+        clear_day_cache()
+        progress.report()
+
+    def save(self, batch):
+        with atomic():
+            for message in batch:
+                message.render()
+                IRCMessage.objects.filter(id=message.id).update(
+                    message_html=message.message_html,
+                    nickname_color=message.nickname_color)
+
+    def benchmark(self, num_messages=10000):
+        """
+        Renders a day's worth of messages in the archive's template,
+        as they were rendered before their HTML was stored, and then
+        with their stored HTML.
+        """
+        start_time = now() - timedelta(days=1)
+        messages = []
+        for i in range(num_messages):
+            text = "message %s with a link to http://example.com/%s" % (i, i)
+            messages.append(IRCMessage(id=i + 1, nickname="user%s" % (i % 50),
+                message=text, message_time=start_time + timedelta(seconds=i)))
+        for i, message in enumerate(messages):
+            message.new_day = i == 0
+        context = {"messages": messages, "query": None}
+        template = "gnotty/includes/messages.html"
+        # Load the template before timing.
+        render_to_string(template, {"messages": []})
+        for name in ("Before", "After"):
+            if name == "After":
+                for message in messages:
+                    message.render()
+            start = time()
+            render_to_string(template, context)
+            print "%s: %.3fs to render %s messages" % (name, time() - start,
+                                                       num_messages)
@@ -0,0 +1,18 @@
+
+from django.core.management.base import BaseCommand
+
+from gnotty.models import DailyActivity
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds the daily message counts used by the archive calendar
+    from all logged messages, both in the database and in the
+    segments written by ``gnotty_archive``.
+    """
+
+    help = "Rebuilds the daily message counts for the archive calendar"
+
+    def handle(self, *args, **options):
+        days = DailyActivity.rebuild()
+        print "Counted messages for %s days" % days
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding index on 'IRCMessage', fields ['message_time']
+        db.create_index('gnotty_ircmessage', ['message_time'])
+
+        # Adding index on 'IRCMessage', fields ['join_or_leave', 'message_time']
+        db.create_index('gnotty_ircmessage', ['join_or_leave', 'message_time'])
+
+
+    def backwards(self, orm):
+        # Removing index on 'IRCMessage', fields ['join_or_leave', 'message_time']
+        db.delete_index('gnotty_ircmessage', ['join_or_leave', 'message_time'])
+
+        # Removing index on 'IRCMessage', fields ['message_time']
+        db.delete_index('gnotty_ircmessage', ['message_time'])
+
+
+    models = {
+        'gnotty.ircmessage': {
+            'Meta': {'ordering': "('message_time',)", 'object_name': 'IRCMessage', 'index_together': "(('join_or_leave', 'message_time'),)"},
+            'channel': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'join_or_leave': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'message': ('django.db.models.fields.TextField', [], {}),
+            'message_time': ('django.db.models.fields.DateTimeField', [], {'default': 'django.utils.timezone.now', 'db_index': 'True'}),
+            'nickname': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'server': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        }
+    }
+
+    complete_apps = ['gnotty']
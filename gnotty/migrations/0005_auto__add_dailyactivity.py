@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'DailyActivity'
+        db.create_table('gnotty_dailyactivity', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('channel', self.gf('django.db.models.fields.CharField')(max_length=100)),
+            ('day', self.gf('django.db.models.fields.DateField')()),
+            ('messages', self.gf('django.db.models.fields.PositiveIntegerField')(default=0)),
+            ('joins_leaves', self.gf('django.db.models.fields.PositiveIntegerField')(default=0)),
+        ))
+        db.send_create_signal('gnotty', ['DailyActivity'])
+
+        # Adding unique constraint on 'DailyActivity', fields ['channel', 'day']
+        db.create_unique('gnotty_dailyactivity', ['channel', 'day'])
+
+
+    def backwards(self, orm):
+        # Removing unique constraint on 'DailyActivity', fields ['channel', 'day']
+        db.delete_unique('gnotty_dailyactivity', ['channel', 'day'])
+
+        # Deleting model 'DailyActivity'
+        db.delete_table('gnotty_dailyactivity')
+
+
+    models = {
+        'gnotty.dailyactivity': {
+            'Meta': {'ordering': "('day',)", 'unique_together': "(('channel', 'day'),)", 'object_name': 'DailyActivity'},
+            'channel': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'day': ('django.db.models.fields.DateField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'joins_leaves': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'messages': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'})
+        },
+        'gnotty.ircmessage': {
+            'Meta': {'ordering': "('message_time',)", 'object_name': 'IRCMessage', 'index_together': "(('join_or_leave', 'message_time'),)"},
+            'channel': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'join_or_leave': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'message': ('django.db.models.fields.TextField', [], {}),
+            'message_time': ('django.db.models.fields.DateTimeField', [], {'default': 'django.utils.timezone.now', 'db_index': 'True'}),
+            'nickname': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'server': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        }
+    }
+
+    complete_apps = ['gnotty']
\ No newline at end of file
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding field 'IRCMessage.message_html'
+        db.add_column('gnotty_ircmessage', 'message_html',
+                      self.gf('django.db.models.fields.TextField')(default='', blank=True),
+                      keep_default=False)
+
+        # Adding field 'IRCMessage.nickname_color'
+        db.add_column('gnotty_ircmessage', 'nickname_color',
+                      self.gf('django.db.models.fields.CharField')(default='', max_length=20, blank=True),
+                      keep_default=False)
+
+
+    def backwards(self, orm):
+        # Deleting field 'IRCMessage.message_html'
+        db.delete_column('gnotty_ircmessage', 'message_html')
+
+        # Deleting field 'IRCMessage.nickname_color'
+        db.delete_column('gnotty_ircmessage', 'nickname_color')
+
+
+    models = {
+        'gnotty.dailyactivity': {
+            'Meta': {'ordering': "('day',)", 'unique_together': "(('channel', 'day'),)", 'object_name': 'DailyActivity'},
+            'channel': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'day': ('django.db.models.fields.DateField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'joins_leaves': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'messages': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'})
+        },
+        'gnotty.ircmessage': {
+            'Meta': {'ordering': "('message_time',)", 'object_name': 'IRCMessage', 'index_together': "(('join_or_leave', 'message_time'),)"},
+            'channel': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'join_or_leave': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'message': ('django.db.models.fields.TextField', [], {}),
+            'message_html': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'message_time': ('django.db.models.fields.DateTimeField', [], {'default': 'django.utils.timezone.now', 'db_index': 'True'}),
+            'nickname': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'nickname_color': ('django.db.models.fields.CharField', [], {'max_length': '20', 'blank': 'True'}),
+            'server': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        }
+    }
+
+    complete_apps = ['gnotty']
\ No newline at end of file
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import DataMigration
+from django.db import models
+
+from gnotty.models import DailyActivity
+
+
+class Migration(DataMigration):
+
+    def forwards(self, orm):
+        "Counts the messages already logged for the archive calendar."
+        if not db.dry_run:
+            fields = ("channel", "message_time", "join_or_leave")
+            messages = orm["gnotty.IRCMessage"].objects.order_by()
+            counts = DailyActivity.count(messages.values_list(*fields)
+                                         .iterator())
+            orm["gnotty.DailyActivity"].objects.all().delete()
+            orm["gnotty.DailyActivity"].objects.bulk_create([
+                orm["gnotty.DailyActivity"](channel=channel, day=day,
+                                            messages=num_messages,
+                                            joins_leaves=joins_leaves)
+                for (channel, day), (num_messages, joins_leaves)
+                in counts.items()
+            ])
+
+
+    def backwards(self, orm):
+        "Removes the counts."
+        if not db.dry_run:
+            orm["gnotty.DailyActivity"].objects.all().delete()
+
+    models = {
+        'gnotty.dailyactivity': {
+            'Meta': {'ordering': "('day',)", 'unique_together': "(('channel', 'day'),)", 'object_name': 'DailyActivity'},
+            'channel': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'day': ('django.db.models.fields.DateField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'joins_leaves': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'messages': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'})
+        },
+        'gnotty.ircmessage': {
+            'Meta': {'ordering': "('message_time',)", 'object_name': 'IRCMessage', 'index_together': "(('join_or_leave', 'message_time'),)"},
+            'channel': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'join_or_leave': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'message': ('django.db.models.fields.TextField', [], {}),
+            'message_html': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'message_time': ('django.db.models.fields.DateTimeField', [], {'default': 'django.utils.timezone.now', 'db_index': 'True'}),
+            'nickname': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'nickname_color': ('django.db.models.fields.CharField', [], {'max_length': '20', 'blank': 'True'}),
+            'server': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        }
+    }
+
+    complete_apps = ['gnotty']
@@ -1,9 +1,20 @@
 
-from django.db import models
+from collections import defaultdict
+
+from django.db import models, transaction, IntegrityError
+from django.db.models import F
+from django.utils.html import urlize
+from django.utils.timezone import is_aware, localtime, now
 from django.utils.translation import ugettext_lazy as _
 
 from gnotty.client import color
 
+try:
+    atomic = transaction.atomic
+except AttributeError:
+    # Django < 1.6
+    atomic = transaction.commit_on_success
+
 
 class IRCMessage(models.Model):
     """
@@ -15,13 +26,20 @@ class IRCMessage(models.Model):
     message = models.TextField(_("Message"))
     server = models.CharField(_("Server"), max_length=100)
     channel = models.CharField(_("Channel"), max_length=100)
-    message_time = models.DateTimeField(_("Time"), auto_now_add=True)
+    message_time = models.DateTimeField(_("Time"), default=now,
+                                        db_index=True)
     join_or_leave = models.BooleanField(default=False)
+    message_html = models.TextField(_("Message HTML"), blank=True)
+    nickname_color = models.CharField(_("Nickname color"), max_length=20,
+                                      blank=True)
 
     class Meta:
         verbose_name = _("Message")
         verbose_name_plural = _("Messages")
         ordering = ("message_time",)
+        index_together = (
+            ("join_or_leave", "message_time"),
+        )
 
     def __unicode__(self):
         return "[%s] %s%s %s: %s" % (self.message_time, self.server,
@@ -41,5 +59,130 @@ class IRCMessage(models.Model):
         return self.message[:50]
     short_message.short_description = _("Message")
 
+    def save(self, *args, **kwargs):
+        if not self.message_html:
+            self.render()
+        super(IRCMessage, self).save(*args, **kwargs)
+
+    def render(self):
+        """
+        Renders the escaped and linkified HTML for the message, and
+        the nickname's color, which are stored so that the archive
+        doesn't need to render them for each message it shows. Called
+        when saving, and for each message saved with ``bulk_create``.
+        """
+        self.message_html = urlize(self.message, nofollow=True,
+                                   autoescape=True)
+        self.nickname_color = color(self.nickname)
+
     def color(self):
-        return color(self.nickname)
+        return self.nickname_color or color(self.nickname)
+
+
+def message_day(message_time):
+    """
+    Date of a message in the current timezone, which is the day it's
+    shown under in the archive.
+    """
+    if is_aware(message_time):
+        message_time = localtime(message_time)
+    return message_time.date()
+
+
+class DailyActivity(models.Model):
+    """
+    Number of messages, and how many of them are joins or leaves,
+    logged in a channel each day. Kept up to date as messages are
+    logged, so the archive calendar doesn't need to scan messages.
+    """
+
+    channel = models.CharField(_("Channel"), max_length=100)
+    day = models.DateField(_("Day"))
+    messages = models.PositiveIntegerField(_("Messages"), default=0)
+    joins_leaves = models.PositiveIntegerField(_("Joins/leaves"), default=0)
+
+    class Meta:
+        verbose_name = _("Daily activity")
+        verbose_name_plural = _("Daily activity")
+        unique_together = ("channel", "day")
+        ordering = ("day",)
+
+    def __unicode__(self):
+        return "[%s] %s: %s" % (self.day, self.channel, self.messages)
+
+    @classmethod
+    def count(cls, messages):
+        """
+        Counts messages and joins/leaves per channel per day for the
+        given (channel, message_time, join_or_leave) tuples.
+        """
+        counts = defaultdict(lambda: [0, 0])
+        for channel, message_time, join_or_leave in messages:
+            key = (channel, message_day(message_time))
+            counts[key][0] += 1
+            counts[key][1] += int(join_or_leave)
+        return counts
+
+    @classmethod
+    def add(cls, messages):
+        """
+        Adds newly logged messages to the daily counts.
+        """
+        counts = cls.count((m.channel, m.message_time, m.join_or_leave)
+                           for m in messages)
+        cls.add_counts(counts)
+
+    @classmethod
+    def add_counts(cls, counts):
+        """
+        Adds the counts returned by ``count`` to the daily counts.
+        """
+        for (channel, day), (num_messages, joins_leaves) in counts.items():
+            lookup = {"channel": channel, "day": day}
+            update = {
+                "messages": F("messages") + num_messages,
+                "joins_leaves": F("joins_leaves") + joins_leaves,
+            }
+            if not cls.objects.filter(**lookup).update(**update):
+                # The create is done in a savepoint, so that if it fails,
+                # the update can still be run in the same transaction.
+                savepoint = transaction.savepoint()
+                try:
+                    cls.objects.create(messages=num_messages,
+                                       joins_leaves=joins_leaves, **lookup)
+                except IntegrityError:
+                    # Created by another process since the update.
+                    transaction.savepoint_rollback(savepoint)
+                    cls.objects.filter(**lookup).update(**update)
+                else:
+                    transaction.savepoint_commit(savepoint)
+
+    @classmethod
+    def rebuild(cls):
+        """
+        Recounts all logged messages, including those moved out of the
+        database by the gnotty_archive command, so that archived days
+        stay in the calendar. The counts are replaced in a single
+        transaction, so the calendar is never left empty.
+        """
+        # Imported here since gnotty.archive imports this module.
+        from gnotty.archive import archived_days, read_segment
+        fields = ("channel", "message_time", "join_or_leave")
+        messages = IRCMessage.objects.order_by().values_list(*fields)
+        counts = cls.count(messages.iterator())
+        for channel, day in archived_days():
+            segment = read_segment(channel, day)
+            archived = cls.count((m.channel, m.message_time, m.join_or_leave)
+                                 for m in segment)
+            for key, (num_messages, joins_leaves) in archived.items():
+                counts[key][0] += num_messages
+                counts[key][1] += joins_leaves
+        with atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create([
+                cls(channel=channel, day=day, messages=num_messages,
+                    joins_leaves=joins_leaves)
+                for (channel, day), (num_messages, joins_leaves)
+                in counts.items()
+            ])
+        return len(counts)
@@ -0,0 +1,208 @@
+
+from re import findall
+
+from django.db import connection, transaction
+from django.db.models import Q
+
+from gnotty.conf import settings
+from gnotty.models import IRCMessage
+
+
+def terms(query):
+    """
+    Splits a search query into terms, keeping quoted phrases together.
+    """
+    return [phrase or word for phrase, word in
+            findall(r'"([^"]+)"|(\S+)', query)]
+
+
+class ContainsSearch(object):
+    """
+    Searches messages with a case-insensitive substring match of the
+    whole query on the message and nickname. This requires no set up,
+    but scans the entire table, so it's only suitable for small
+    archives. Results can't be ranked.
+    """
+
+    can_rank = False
+
+    def installed(self):
+        return True
+
+    def install(self):
+        pass
+
+    def backfill(self):
+        pass
+
+    def search(self, messages, query, rank=False):
+        search = Q(message__icontains=query) | Q(nickname__icontains=query)
+        return messages.filter(search)
+
+
+class FullTextSearch(ContainsSearch):
+    """
+    Base for the database specific full-text search backends. The
+    SQL for each backend is filled in with the quoted table name.
+    """
+
+    can_rank = True
+    vendor = None
+    installed_sql = None
+    install_sql = []
+    backfill_sql = []
+    where_sql = None
+    rank_sql = None
+
+    def sql(self, sql):
+        return sql % {
+            "table": connection.ops.quote_name(IRCMessage._meta.db_table),
+            "index": connection.ops.quote_name("gnotty_ircmessage_search"),
+        }
+
+    def execute(self, statements):
+        cursor = connection.cursor()
+        for sql in statements:
+            cursor.execute(self.sql(sql))
+        try:
+            transaction.commit_unless_managed()
+        except AttributeError:
+            # Django >= 1.6 autocommits.
+            pass
+
+    def installed(self):
+        if connection.vendor != self.vendor:
+            return False
+        cursor = connection.cursor()
+        cursor.execute(self.installed_sql)
+        return cursor.fetchone() is not None
+
+    def install(self):
+        self.execute(self.install_sql)
+
+    def backfill(self):
+        self.execute(self.backfill_sql)
+
+    def match(self, query):
+        """
+        Converts the search query into the database's query syntax.
+        """
+        return query
+
+    def search(self, messages, query, rank=False):
+        match = self.match(query)
+        messages = messages.extra(where=[self.sql(self.where_sql)],
+                                  params=[match])
+        if rank:
+            select = {"rank": self.sql(self.rank_sql)}
+            messages = messages.extra(select=select, select_params=[match])
+            messages = messages.order_by("-rank", "-message_time")
+        return messages
+
+
+class SQLiteSearch(FullTextSearch):
+    """
+    SQLite FTS5 table that indexes the message and nickname columns,
+    kept up to date by triggers on the messages table.
+    """
+
+    vendor = "sqlite"
+    installed_sql = ("SELECT name FROM sqlite_master "
+                     "WHERE name = 'gnotty_ircmessage_search'")
+    install_sql = [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS %(index)s USING fts5("
+        "message, nickname, content=%(table)s, content_rowid='id')",
+        "CREATE TRIGGER IF NOT EXISTS gnotty_ircmessage_search_insert "
+        "AFTER INSERT ON %(table)s BEGIN "
+        "INSERT INTO %(index)s(rowid, message, nickname) "
+        "VALUES (new.id, new.message, new.nickname); END",
+        "CREATE TRIGGER IF NOT EXISTS gnotty_ircmessage_search_delete "
+        "AFTER DELETE ON %(table)s BEGIN "
+        "INSERT INTO %(index)s(%(index)s, rowid, message, nickname) "
+        "VALUES ('delete', old.id, old.message, old.nickname); END",
+        "CREATE TRIGGER IF NOT EXISTS gnotty_ircmessage_search_update "
+        "AFTER UPDATE ON %(table)s BEGIN "
+        "INSERT INTO %(index)s(%(index)s, rowid, message, nickname) "
+        "VALUES ('delete', old.id, old.message, old.nickname); "
+        "INSERT INTO %(index)s(rowid, message, nickname) "
+        "VALUES (new.id, new.message, new.nickname); END",
+    ]
+    backfill_sql = ["INSERT INTO %(index)s(%(index)s) VALUES ('rebuild')"]
+    where_sql = ("%(table)s.id IN (SELECT rowid FROM %(index)s "
+                 "WHERE %(index)s MATCH %%s)")
+    # FTS5's rank is lower for better matches, so negate it to sort
+    # descending like the Postgres rank.
+    rank_sql = ("SELECT -rank FROM %(index)s WHERE %(index)s MATCH %%s "
+                "AND rowid = %(table)s.id")
+
+    def match(self, query):
+        return " ".join('"%s"' % term.replace('"', '""')
+                        for term in terms(query))
+
+
+class PostgresSearch(FullTextSearch):
+    """
+    Postgres GIN index on the message and nickname ``tsvector``, which
+    Postgres keeps up to date itself. Queries use the same syntax as
+    web search engines, with quoted phrases, ``or``, and ``-``.
+    """
+
+    vendor = "postgresql"
+    document = ("to_tsvector('english', %(table)s.nickname || ' ' || "
+                "%(table)s.message)")
+    installed_sql = ("SELECT indexname FROM pg_indexes "
+                     "WHERE indexname = 'gnotty_ircmessage_search'")
+    install_sql = ["CREATE INDEX %(index)s ON %(table)s USING GIN "
+                   "((" + document + "))"]
+    where_sql = document + " @@ websearch_to_tsquery('english', %%s)"
+    rank_sql = ("ts_rank(" + document + ", "
+                "websearch_to_tsquery('english', %%s))")
+
+    def install(self):
+        if not self.installed():
+            super(PostgresSearch, self).install()
+
+
+backends = {
+    "contains": ContainsSearch,
+    "sqlite": SQLiteSearch,
+    "postgresql": PostgresSearch,
+}
+
+backend = None
+
+
+def get_backend():
+    """
+    Returns the search backend for ``SEARCH_BACKEND``, or for the
+    database in use when set to ``auto``, falling back to the
+    ``contains`` backend if the full-text index hasn't been created.
+    The fallback isn't stored, so that the index is used as soon as
+    it's created, without restarting.
+    """
+    global backend
+    if backend is not None:
+        return backend
+    name = settings.SEARCH_BACKEND
+    if name == "auto":
+        name = connection.vendor
+        if name not in backends or not backends[name]().installed():
+            return ContainsSearch()
+    backend = backends[name]()
+    return backend
+
+
+def can_rank():
+    """
+    Whether the search backend in use can order results by how well
+    they match.
+    """
+    return get_backend().can_rank
+
+
+def search(messages, query, rank=False):
+    """
+    Filters the messages by the search query, ordering them by how
+    well they match if ``rank`` is true.
+    """
+    return get_backend().search(messages, query, rank)
@@ -1,49 +1,389 @@
 #!/usr/bin/env python
 
 from __future__ import with_statement
-from gevent import monkey, spawn, sleep
+from gevent import (getcurrent, get_hub, monkey, reinit, spawn, spawn_later,
+                    sleep, signal as gevent_signal)
 monkey.patch_all()
 
-from Cookie import SimpleCookie
+from collections import deque
+from Cookie import CookieError, SimpleCookie
+from cStringIO import StringIO
 from cgi import FieldStorage
-from logging import getLogger, StreamHandler
+from email.utils import formatdate
+from glob import glob
+from gzip import GzipFile
+from hashlib import md5
+from logging import getLogger, shutdown as shutdown_logging, StreamHandler
 from mimetypes import guess_type
 import os
+import signal
+import socket
 import sys
 from tempfile import gettempdir
+from time import time
 from traceback import format_exc
 
 from daemon import daemonize
+from gevent.server import StreamServer
 from socketio import socketio_manage
+from socketio.handler import SocketIOHandler
 from socketio.server import SocketIOServer
 from socketio.namespace import BaseNamespace
 
-from gnotty.client import WebSocketIRCClient
+from gnotty.cache import LRUCache
+from gnotty.client import SpectatorIRCClient, WebSocketIRCClient
 from gnotty.conf import settings
 
+try:
+    from brotli import compress as brotli_compress
+except ImportError:
+    brotli_compress = None
+
 
 HTTP_STATUS_TEXT = {
     200: "OK",
     301: "MOVED PERMANENTLY",
+    304: "NOT MODIFIED",
     401: "UNAUTHORIZED",
     404: "NOT FOUND",
     500: "INTERNAL SERVER ERROR",
 }
 
+# Static files larger than this many bytes are streamed from disk
+# rather than held in memory.
+STATIC_STREAM_SIZE = 1024 * 1024
+STATIC_CHUNK_SIZE = 64 * 1024
+STATIC_MAX_AGE = 60 * 60
+
+# Seconds to wait before trying again to send queued events to a
+# browser that hasn't yet received the last events sent to it.
+FLUSH_RETRY_DELAY = 0.05
+
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/javascript",
+    "application/x-javascript",
+    "application/json",
+    "image/svg+xml",
+)
+
+
+def gzip_compress(content):
+    """
+    Gzip the given string, with a fixed timestamp so that the
+    compressed content doesn't vary between loads.
+    """
+    buf = StringIO()
+    with GzipFile(fileobj=buf, mode="wb", compresslevel=9, mtime=0) as f:
+        f.write(content)
+    return buf.getvalue()
+
+
+class StaticFile(object):
+    """
+    A static file held in memory along with its compressed variants,
+    that's reloaded whenever its modification time changes. Responds
+    to conditional requests with 304 responses, and to requests that
+    accept compressed content with the gzip (or brotli if installed)
+    variant.
+    """
+
+    max_age = STATIC_MAX_AGE
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = None
+        self.variants = {}
+        self.content_type = guess_type(path)[0] or "application/octet-stream"
+
+    def load(self):
+        """
+        Reads the file if it has been modified since it was last read.
+        Raises ``OSError`` or ``IOError`` if the file can't be read.
+        """
+        stat = os.stat(self.path)
+        if stat.st_mtime == self.mtime:
+            return
+        self.size = stat.st_size
+        self.etag = '"%x-%x"' % (int(stat.st_mtime), stat.st_size)
+        self.last_modified = formatdate(stat.st_mtime, usegmt=True)
+        self.variants = {}
+        if self.size <= STATIC_STREAM_SIZE:
+            with open(self.path, "rb") as f:
+                self.set_content(f.read())
+        self.mtime = stat.st_mtime
+
+    def set_content(self, content):
+        """
+        Stores the content and its compressed variants.
+        """
+        self.variants = {"identity": content}
+        if self.content_type.startswith(COMPRESSIBLE_TYPES):
+            self.variants["gzip"] = gzip_compress(content)
+            if brotli_compress is not None:
+                self.variants["br"] = brotli_compress(content)
+
+    def stream(self):
+        """
+        Reads the file in chunks for files too large to hold in memory.
+        """
+        with open(self.path, "rb") as f:
+            while True:
+                chunk = f.read(STATIC_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+
+    def not_modified(self, environ):
+        """
+        Returns ``True`` if the request's conditional headers match
+        the current version of the file.
+        """
+        if_none_match = environ.get("HTTP_IF_NONE_MATCH")
+        if if_none_match is not None:
+            etags = [etag.strip() for etag in if_none_match.split(",")]
+            return self.etag in etags or "*" in etags
+        return environ.get("HTTP_IF_MODIFIED_SINCE") == self.last_modified
+
+    def encoding(self, environ):
+        """
+        The best of the available variants the request accepts.
+        """
+        accepted = set()
+        for encoding in environ.get("HTTP_ACCEPT_ENCODING", "").split(","):
+            encoding = encoding.strip().split(";")
+            if "q=0" not in [param.strip() for param in encoding[1:]]:
+                accepted.add(encoding[0].strip())
+        for encoding in ("br", "gzip"):
+            if encoding in accepted and encoding in self.variants:
+                return encoding
+        return "identity"
+
+    def response(self, environ):
+        """
+        Returns the response tuple for a request for the file.
+        """
+        self.load()
+        headers = [
+            ("Content-Type", self.content_type),
+            ("ETag", self.etag),
+            ("Last-Modified", self.last_modified),
+            ("Cache-Control", "public, max-age=%s" % self.max_age),
+            ("Vary", "Accept-Encoding"),
+        ]
+        if self.not_modified(environ):
+            return (304, headers, None)
+        if not self.variants:
+            headers.append(("Content-Length", str(self.size)))
+            return (200, headers, self.stream())
+        encoding = self.encoding(environ)
+        content = self.variants[encoding]
+        if encoding != "identity":
+            headers.append(("Content-Encoding", encoding))
+        headers.append(("Content-Length", str(len(content))))
+        return (200, headers, content)
+
+
+class IndexPage(StaticFile):
+    """
+    The chat interface page when Django isn't being used. Rendered
+    once and kept along with its compressed variants, until either
+    its templates or the settings change.
+    """
+
+    max_age = 0
+
+    def __init__(self, render):
+        template_dir = os.path.join(os.path.dirname(__file__),
+                                    "templates", "gnotty")
+        self.templates = [os.path.join(template_dir, name)
+                          for name in ("base.html", "chat.html")]
+        self.render = render
+        self.version = None
+        super(IndexPage, self).__init__(self.templates[-1])
+
+    def load(self):
+        """
+        Renders the page if its templates or the settings have changed
+        since it was last rendered.
+        """
+        mtimes = tuple([os.stat(path).st_mtime for path in self.templates])
+        version = (mtimes, hash(repr(sorted(settings.items()))))
+        if version == self.version:
+            return
+        content = self.render()
+        if isinstance(content, unicode):
+            content = content.encode("utf-8")
+        self.size = len(content)
+        self.etag = '"%s"' % md5(content).hexdigest()
+        self.last_modified = formatdate(time(), usegmt=True)
+        self.set_content(content)
+        self.version = version
+
 
 class IRCNamespace(BaseNamespace):
     """
     gevent-socketio namespace that's bridged with an IRC client.
+
+    Events emitted to the WebSocket are collected for up to
+    ``BATCH_WINDOW`` milliseconds, or until ``BATCH_SIZE`` events
+    have been collected, and then sent together as a single ``batch``
+    event, so that bursts of IRC traffic don't each cost a frame (or
+    an entire polling response) per event.
+
+    Events are only sent once the browser has received the previous
+    events sent, and until then they're held in a queue of at most
+    ``QUEUE_SIZE`` events, so that a browser on a slow connection
+    can't cause an unbounded backlog of events in memory. When the
+    queue is full, the ``QUEUE_OVERFLOW`` policy applies - ``drop``
+    discards the oldest message, ``skip`` does the same but tells the
+    browser how many messages it skipped, and ``disconnect`` gives up
+    on the browser, which can then resume its session. Only message
+    events are discarded, since the browser's nicknames list and
+    session depend on every other event.
     """
 
-    def on_start(self, host, port, channel, nickname, password):
+    def initialize(self):
+        self.queue = deque()
+        self.flusher = None
+        self.sent = 0
+        self.dropped = 0
+        self.skipped = 0
+
+    def queue_stats(self):
         """
-        A WebSocket session has started - create a greenlet to host
-        the IRC client, and start it.
+        Current depth of the queue, and counts of events sent and
+        dropped for the session.
         """
-        self.client = WebSocketIRCClient(host, port, channel, nickname,
-                                         password, self)
-        self.spawn(self.client.start)
+        return {
+            "depth": len(self.queue),
+            "pending": self.socket.client_queue.qsize(),
+            "sent": self.sent,
+            "dropped": self.dropped,
+        }
+
+    def emit(self, event, *args, **kwargs):
+        """
+        Add the event to the queue, and schedule the queue to be
+        flushed. Events with an ack callback are sent immediately,
+        after any events already queued so that they stay in order.
+        """
+        if kwargs:
+            self.flush(force=True)
+            super(IRCNamespace, self).emit(event, *args, **kwargs)
+            return
+        full = len(self.queue) >= settings.QUEUE_SIZE
+        if full and not self.overflow(event):
+            return
+        self.queue.append([event] + list(args))
+        full = len(self.queue) >= settings.BATCH_SIZE
+        if full or settings.BATCH_WINDOW <= 0:
+            self.flush()
+        else:
+            self.schedule_flush()
+
+    def overflow(self, event):
+        """
+        The queue is full - apply the ``QUEUE_OVERFLOW`` policy.
+        Returns ``False`` if the new event should be discarded. If no
+        messages are queued, a new message is discarded, and any other
+        new event is queued regardless.
+        """
+        if settings.QUEUE_OVERFLOW == "disconnect":
+            getLogger("irc.dispatch").info("Disconnecting stalled session "
+                                           "%s" % self.socket.sessid)
+            self.keep_missed()
+            self.socket.kill()
+            return False
+        discard_new = False
+        for i, queued in enumerate(self.queue):
+            if queued[0] == "message":
+                del self.queue[i]
+                break
+        else:
+            if event != "message":
+                return True
+            discard_new = True
+        self.dropped += 1
+        if settings.QUEUE_OVERFLOW == "skip":
+            self.skipped += 1
+        return not discard_new
+
+    def schedule_flush(self, delay=None):
+        """
+        Flush the queue once ``BATCH_WINDOW`` has passed, or after
+        ``delay`` seconds when given.
+        """
+        if self.flusher is None:
+            if delay is None:
+                delay = settings.BATCH_WINDOW / 1000.
+            self.flusher = spawn_later(delay, self.flush)
+
+    def flush(self, force=False):
+        """
+        Send the queued events to the WebSocket, unless it still hasn't
+        received the last events sent, in which case try again later.
+        A lone event is sent as is, rather than as a batch of one. With
+        ``force``, all of the queued events are sent regardless.
+        """
+        flusher, self.flusher = self.flusher, None
+        if flusher is not None and flusher is not getcurrent():
+            flusher.kill(block=False)
+        if self.socket.client_queue.qsize() > 0 and not force:
+            self.schedule_flush(FLUSH_RETRY_DELAY)
+            return
+        while True:
+            batch = []
+            if self.skipped:
+                batch.append(["skipped", self.skipped])
+                self.skipped = 0
+            while self.queue and len(batch) < settings.BATCH_SIZE:
+                batch.append(self.queue.popleft())
+            self.sent += len(batch)
+            if len(batch) == 1:
+                super(IRCNamespace, self).emit(*batch[0])
+            elif batch:
+                super(IRCNamespace, self).emit("batch", batch)
+            if not force or not self.queue:
+                break
+        if self.queue:
+            self.schedule_flush()
+
+    def on_spectate(self, host, port, channel):
+        """
+        A WebSocket session has started without a nickname - subscribe
+        to the shared read-only listener for the channel, rather than
+        creating an IRC connection for the session.
+        """
+        self.stop_spectating()
+        self.spectating = SpectatorIRCClient.subscribe(host, port,
+                                                       channel, self)
+
+    def stop_spectating(self):
+        """
+        Unsubscribe from the shared listener if we're spectating.
+        """
+        spectating = getattr(self, "spectating", None)
+        if spectating is not None:
+            spectating.unsubscribe(self)
+            self.spectating = None
+
+    def on_start(self, host, port, channel, nickname, password,
+                 token=None):
+        """
+        A nickname has been given - resume the IRC client for the
+        session token if it's still connected, otherwise create a new
+        IRC client and start it in its own greenlet.
+        """
+        self.stop_spectating()
+        try:
+            self.client = WebSocketIRCClient.sessions[token]
+        except KeyError:
+            self.client = WebSocketIRCClient(host, port, channel, nickname,
+                                             password, self)
+            self.client.run()
+        else:
+            self.client.attach(self)
 
     def on_message(self, message):
         """
@@ -52,25 +392,64 @@ class IRCNamespace(BaseNamespace):
         if hasattr(self, "client"):
             self.client.emit_message(message)
 
+    def on_leave(self):
+        """
+        The user explicitly left - leave the IRC channel right away
+        rather than keeping the session around for it to be resumed.
+        """
+        if hasattr(self, "client"):
+            self.client.leave()
+        return []
+
+    def keep_missed(self):
+        """
+        Moves the events not yet sent to the IRC client's missed
+        events, which are replayed if the session is resumed, along
+        with those that occur once detached.
+        """
+        if hasattr(self, "client") and self.client.namespace is self:
+            roster_events = self.client.roster_events
+            self.client.missed.extend([tuple(event) for event in self.queue
+                                       if event[0] not in roster_events])
+        self.queue.clear()
+
     def disconnect(self, *args, **kwargs):
         """
-        WebSocket was disconnected - leave the IRC channel.
+        WebSocket was disconnected - detach from the IRC client, which
+        will leave the IRC channel if the session isn't resumed.
         """
-        quit_message = "%s %s" % (settings.GNOTTY_VERSION_STRING,
-                                  settings.GNOTTY_PROJECT_URL)
-        self.client.connection.quit(quit_message)
+        self.stop_spectating()
+        if self.flusher is not None:
+            self.flusher.kill(block=False)
+        stats = self.queue_stats()
+        stats["sessid"] = self.socket.sessid
+        getLogger("irc.dispatch").info("Session %(sessid)s disconnected: "
+                                       "%(sent)s events sent, %(dropped)s "
+                                       "dropped, %(depth)s queued" % stats)
+        self.keep_missed()
+        if hasattr(self, "client"):
+            self.client.detach(self)
         super(IRCNamespace, self).disconnect(*args, **kwargs)
 
 
 class IRCApplication(object):
 
-    def __init__(self, django=False):
+    def __init__(self, django=False, run_bot=True):
         """
         Loads and starts the IRC bot for the entire application.
+        When running multiple worker processes, only one of them
+        runs the bot.
         """
         self.django = django
         self.bot = None
-        if settings.BOT_CLASS:
+        self.static_files = {}
+        self.index_page = IndexPage(self.index)
+        self.auth_cache = LRUCache(settings.AUTH_CACHE_SIZE,
+                                   settings.AUTH_CACHE_TTL)
+        if self.django and settings.LOGIN_REQUIRED:
+            from django.contrib.auth.signals import user_logged_out
+            user_logged_out.connect(self.logged_out)
+        if run_bot and settings.BOT_CLASS:
             module_name, class_name = settings.BOT_CLASS.rsplit(".", 1)
             __import__(module_name)
             bot_class = getattr(sys.modules[module_name], class_name)
@@ -83,6 +462,14 @@ class IRCApplication(object):
         self.logger.setLevel(settings.LOG_LEVEL)
         self.logger.addHandler(StreamHandler())
 
+    def close(self):
+        """
+        Stops the bot's handler workers and worker processes, when
+        the server has stopped.
+        """
+        if self.bot is not None:
+            self.bot.close()
+
     def bot_watcher(self):
         """
         Thread (greenlet) that will try and reconnect the bot if
@@ -123,22 +510,26 @@ class IRCApplication(object):
         """
         path = os.path.normpath(environ["PATH_INFO"])
         if path == "/":
-            content = self.index()
-            content_type = "text/html"
-        else:
-            path = os.path.join(os.path.dirname(__file__), path.lstrip("/"))
-            try:
-                with open(path, "r") as f:
-                    content = f.read()
-            except IOError:
-                return 404
-            content_type = guess_type(path)[0]
-        return (200, [("Content-Type", content_type)], content)
+            return self.index_page.response(environ)
+        path = os.path.join(os.path.dirname(__file__), path.lstrip("/"))
+        try:
+            static_file = self.static_files[path]
+        except KeyError:
+            static_file = StaticFile(path)
+        try:
+            response = static_file.response(environ)
+        except (IOError, OSError):
+            self.static_files.pop(path, None)
+            return 404
+        self.static_files[path] = static_file
+        return response
 
     def index(self):
         """
         Loads the chat interface template when Django isn't being
-        used, manually dealing with the Django template bits.
+        used, manually dealing with the Django template bits. The
+        result is cached by ``IndexPage``, so this is only called
+        when the templates or settings change.
         """
         root_dir = os.path.dirname(__file__)
         template_dir = os.path.join(root_dir, "templates", "gnotty")
@@ -154,6 +545,7 @@ class IRCApplication(object):
             "{% extends \"gnotty/base.html\" %}": "",
             "{% url gnotty_chat %}": "/",
             "{% gnotty_nav %}": "",
+            "{{ HISTORY_URL }}": "",
             "{% templatetag openvariable %}": "{{",
             "{% templatetag closevariable %}": "}}",
         }
@@ -192,20 +584,52 @@ class IRCApplication(object):
         if self.django and settings.LOGIN_REQUIRED:
             try:
                 from django.conf import settings as django_settings
-                from django.contrib.auth import SESSION_KEY
-                from django.contrib.auth.models import User
-                from django.contrib.sessions.models import Session
-                from django.core.exceptions import ObjectDoesNotExist
                 cookie = SimpleCookie(environ["HTTP_COOKIE"])
                 cookie_name = django_settings.SESSION_COOKIE_NAME
                 session_key = cookie[cookie_name].value
-                session = Session.objects.get(session_key=session_key)
-                user_id = session.get_decoded().get(SESSION_KEY)
-                user = User.objects.get(id=user_id)
-            except (ImportError, KeyError, ObjectDoesNotExist):
+            except (ImportError, KeyError, CookieError):
                 return False
+            try:
+                return self.auth_cache[session_key]
+            except KeyError:
+                # Query the database in a thread, so that a slow
+                # database doesn't block the WebSocket traffic.
+                threadpool = get_hub().threadpool
+                args = (session_key,)
+                authorized, ttl = threadpool.apply(self.session_user, args)
+                self.auth_cache.set(session_key, authorized, ttl)
+                return authorized
         return True
 
+    def session_user(self, session_key):
+        """
+        Validates that the session belongs to an authenticated user.
+        Returns the result and the number of seconds to cache it for,
+        which is no longer than the remaining life of the session.
+        """
+        from django.contrib.auth import SESSION_KEY
+        from django.contrib.auth.models import User
+        from django.contrib.sessions.models import Session
+        from django.core.exceptions import ObjectDoesNotExist
+        from django.utils.timezone import now
+        ttl = settings.AUTH_CACHE_TTL
+        try:
+            session = Session.objects.get(session_key=session_key)
+            user_id = session.get_decoded().get(SESSION_KEY)
+            User.objects.get(id=user_id)
+        except ObjectDoesNotExist:
+            return False, ttl
+        expires = session.expire_date - now()
+        expires = expires.days * 60 * 60 * 24 + expires.seconds
+        return True, max(min(ttl, expires), 0)
+
+    def logged_out(self, sender, request, user, **kwargs):
+        """
+        Handler for Django's ``user_logged_out`` signal, that removes
+        the session from the authorization cache.
+        """
+        self.auth_cache.pop(request.session.session_key)
+
     def __call__(self, environ, start_response):
         """
         WSGI application handler.
@@ -233,20 +657,159 @@ class IRCApplication(object):
         headers.append(("Server", settings.GNOTTY_VERSION_STRING))
         start_response("%s %s" % (status, status_text), headers)
         if content is None:
-            if status == 200:
+            if status in (200, 304):
                 content = ""
             else:
                 content = "<h1>%s</h1>" % status_text.title()
-        return [content]
+        if isinstance(content, basestring):
+            content = [content]
+        return content
+
+
+class WorkerSocketIOHandler(SocketIOHandler):
+    """
+    Closes each connection once its request has been handled. A
+    connection is routed to a worker by its first request, so
+    connections aren't kept alive, otherwise a later request on the
+    same connection could be for a session owned by another worker.
+    """
+
+    def read_request(self, raw_requestline):
+        result = super(WorkerSocketIOHandler, self).read_request(
+            raw_requestline)
+        self.close_connection = True
+        return result
+
+
+class WorkerSocketIOServer(SocketIOServer):
+    """
+    Server for one of several worker processes that accept connections
+    from the same listening socket. Session IDs are prefixed with the
+    index of the worker that owns the session, and connections for a
+    session owned by another worker are passed through to that
+    worker's private socket, so that polling transports keep reaching
+    the worker holding their IRC client. The handshake for resuming
+    an IRC session is routed by the session token given in its
+    querystring, which is also prefixed with the worker's index.
+    Webhooks are passed to the first worker, which runs the bot.
+    """
+
+    def __init__(self, listener, application, worker, **kwargs):
+        self.worker = worker
+        kwargs.setdefault("policy_server", worker == 0)
+        super(WorkerSocketIOServer, self).__init__(listener, application,
+                                                   **kwargs)
+        self.handler_class = WorkerSocketIOHandler
+
+    def get_socket(self, sessid=""):
+        """
+        Prefix the IDs of new sessions with the worker's index.
+        """
+        socket = super(WorkerSocketIOServer, self).get_socket(sessid)
+        prefix = "%s-" % self.worker
+        if not socket.sessid.startswith(prefix):
+            del self.sockets[socket.sessid]
+            socket.sessid = prefix + socket.sessid
+            self.sockets[socket.sessid] = socket
+        return socket
+
+    def request_worker(self, client):
+        """
+        Peeks at the request line of a new connection, without
+        consuming it, and returns the index of the worker that should
+        handle it.
+        """
+        data = ""
+        for _ in range(50):
+            data = client.recv(4096, socket.MSG_PEEK)
+            if not data or "\n" in data or len(data) == 4096:
+                break
+            sleep(.01)
+        try:
+            url = data.split("\n", 1)[0].split()[1]
+        except IndexError:
+            return self.worker
+        path, _, querystring = url.partition("?")
+        parts = path.strip("/").split("/")
+        if parts[0] == "webhook":
+            return 0
+        worker = ""
+        if parts[0] == self.namespace and len(parts) >= 4:
+            worker = parts[3]
+        elif parts[0] == self.namespace:
+            for param in querystring.split("&"):
+                if param.startswith("session="):
+                    worker = param[len("session="):]
+        worker = worker.split("-", 1)[0]
+        if worker.isdigit() and int(worker) < settings.WORKERS:
+            return int(worker)
+        return self.worker
+
+    def handle(self, client, address):
+        worker = self.request_worker(client)
+        if worker == self.worker:
+            self.handle_routed(client, address)
+        else:
+            self.proxy(client, worker)
+
+    def handle_routed(self, client, address):
+        """
+        Handles a connection that's been routed to this worker.
+        Connections passed through from other workers arrive on a
+        Unix socket, so have no address.
+        """
+        if not isinstance(address, tuple):
+            address = ("127.0.0.1", 0)
+        super(WorkerSocketIOServer, self).handle(client, address)
+
+    def proxy(self, client, worker):
+        """
+        Passes the connection through to another worker's private
+        socket, until either side closes.
+        """
+        def pipe(source, dest):
+            try:
+                while True:
+                    data = source.recv(65536)
+                    if not data:
+                        break
+                    dest.sendall(data)
+                dest.shutdown(socket.SHUT_WR)
+            except socket.error:
+                pass
+        upstream = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            upstream.connect(worker_address(worker))
+        except socket.error:
+            client.close()
+            return
+        reader = spawn(pipe, upstream, client)
+        pipe(client, upstream)
+        reader.join()
+        upstream.close()
+        client.close()
+
+
+def worker_address(worker):
+    """
+    Path of the private socket for the given worker index.
+    """
+    name = "gnotty-%s-%s-worker-%s.sock" % (settings.HTTP_HOST,
+                                            settings.HTTP_PORT, worker)
+    return os.path.join(gettempdir(), name)
 
 
 def serve_forever(django=False):
     """
-    Starts the gevent-socketio server.
+    Starts the gevent-socketio server, or its worker processes
+    if ``WORKERS`` is more than one.
     """
     logger = getLogger("irc.dispatch")
     logger.setLevel(settings.LOG_LEVEL)
     logger.addHandler(StreamHandler())
+    if settings.WORKERS > 1:
+        serve_workers(django)
+        return
     app = IRCApplication(django)
     server = SocketIOServer((settings.HTTP_HOST, settings.HTTP_PORT), app)
     print "%s [Bot: %s] listening on %s:%s" % (
@@ -255,20 +818,158 @@ def serve_forever(django=False):
         settings.HTTP_HOST,
         settings.HTTP_PORT,
     )
-    server.serve_forever()
+    try:
+        server.serve_forever()
+    finally:
+        app.close()
 
 
-def kill(pid_file):
+def serve_workers(django=False):
     """
-    Attempts to shut down a previously started daemon.
+    Creates the listening socket and forks a worker process for
+    each of ``WORKERS`` to accept connections from it, restarting
+    any worker that exits. In daemon mode, each worker's PID is
+    written next to the PID file so that ``kill`` can find it.
     """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((settings.HTTP_HOST, settings.HTTP_PORT))
+    listener.listen(1024)
+    workers = {}
+
+    def start_worker(worker):
+        pid = os.fork()
+        if pid == 0:
+            reinit()
+            # Signal handlers inherited from the master (or from
+            # gnottify) shouldn't run in the worker, which installs
+            # its own.
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                signal.signal(signum, signal.SIG_DFL)
+            status = 1
+            try:
+                serve_worker(listener, worker, django)
+                status = 0
+            finally:
+                os._exit(status)
+        workers[pid] = worker
+        if settings.DAEMON:
+            with open(worker_pid_file(get_pid_file(), worker), "w") as f:
+                f.write(str(pid))
+
+    def stop_workers(signum, frame):
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        sys.exit(0)
+
+    for worker in range(settings.WORKERS):
+        start_worker(worker)
+    signal.signal(signal.SIGTERM, stop_workers)
+    signal.signal(signal.SIGINT, stop_workers)
+    print "%s [Bot: %s] [Workers: %s] listening on %s:%s" % (
+        settings.GNOTTY_VERSION_STRING,
+        settings.BOT_CLASS,
+        settings.WORKERS,
+        settings.HTTP_HOST,
+        settings.HTTP_PORT,
+    )
+    while True:
+        try:
+            pid, status = os.waitpid(-1, 0)
+        except OSError:
+            sleep(1)
+            continue
+        worker = workers.pop(pid, None)
+        if worker is not None:
+            start_worker(worker)
+
+
+def serve_worker(listener, worker, django=False):
+    """
+    Runs a single worker process. Only the first worker runs the bot.
+    Along with the shared listening socket, each worker listens on a
+    private socket for connections passed through by other workers.
+    ``SIGTERM`` and ``SIGINT`` stop the worker's servers, after which
+    the bot's worker processes are stopped, and logging is shut down
+    so that its handlers are flushed, since the worker exits without
+    running any exit handlers.
+    """
+    WebSocketIRCClient.token_prefix = "%s-" % worker
+    app = IRCApplication(django, run_bot=worker == 0)
+    server = WorkerSocketIOServer(listener, app, worker)
+    address = worker_address(worker)
+    if os.path.exists(address):
+        os.remove(address)
+    private = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    private.bind(address)
+    private.listen(1024)
+    private_server = StreamServer(private, server.handle_routed)
+    private_server.start()
+
+    def stop(*args):
+        private_server.stop()
+        server.stop()
+
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        gevent_signal(signum, stop)
     try:
-        with open(pid_file) as f:
-            os.kill(int(f.read()), 9)
-        os.remove(pid_file)
-    except (IOError, OSError):
-        return False
-    return True
+        server.serve_forever()
+    finally:
+        app.close()
+    shutdown_logging()
+
+
+def get_pid_file():
+    """
+    Path of the PID file, based on the HTTP host and port if the
+    ``PID_FILE`` setting isn't given.
+    """
+    pid_name = "gnotty-%s-%s.pid" % (settings.HTTP_HOST, settings.HTTP_PORT)
+    return settings.PID_FILE or os.path.join(gettempdir(), pid_name)
+
+
+def worker_pid_file(pid_file, worker):
+    return "%s.worker-%s" % (pid_file, worker)
+
+
+def kill(pid_file, timeout=10):
+    """
+    Attempts to shut down a previously started daemon, along with
+    any of its worker processes. Each process is sent ``SIGTERM`` so
+    that it can save any queued messages, and is only killed if it
+    hasn't exited after ``timeout`` seconds.
+    """
+    pids = []
+    for path in glob(worker_pid_file(pid_file, "*")) + [pid_file]:
+        try:
+            with open(path) as f:
+                pid = int(f.read())
+            os.kill(pid, signal.SIGTERM)
+            os.remove(path)
+        except (IOError, OSError, ValueError):
+            continue
+        pids.append(pid)
+    killed = bool(pids)
+    deadline = time() + timeout
+    while pids:
+        for pid in pids[:]:
+            try:
+                os.kill(pid, 0)
+            except OSError:
+                pids.remove(pid)
+        if time() > deadline:
+            for pid in pids:
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except OSError:
+                    pass
+            break
+        if pids:
+            sleep(.1)
+    return killed
 
 
 def run():
@@ -276,8 +977,7 @@ def run():
     CLI entry point. Parses args and starts the gevent-socketio server.
     """
     settings.parse_args()
-    pid_name = "gnotty-%s-%s.pid" % (settings.HTTP_HOST, settings.HTTP_PORT)
-    pid_file = settings.PID_FILE or os.path.join(gettempdir(), pid_name)
+    pid_file = get_pid_file()
     if settings.KILL:
         if kill(pid_file):
             print "Daemon killed"
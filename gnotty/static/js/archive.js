@@ -0,0 +1,82 @@
+
+/*
+
+Infinite scrolling for the archive. Once the bottom of the messages
+is scrolled to, the messages that follow are loaded from the JSON
+messages API and added to the page, rather than loading the next
+page. If loading fails, the link to the next page is shown instead.
+Takes an options object that should include the following
+members:
+
+    - url:          URL of the JSON messages API.
+    - archiveUrl:   URL of the archive, used for linking to each day.
+
+*/
+var archive = function(options) {
+
+    var table = $('#messages');
+    var loading = false;
+    var more = true;
+
+    // Adds a heading row linking to the day's page.
+    var addDay = function(date) {
+        var parts = date.split('-');
+        var link = $('<a>').text(date);
+        link.attr({href: options.archiveUrl + parts.join('/') + '/'});
+        var heading = $('<th colspan="3">').append($('<h2>').append(link));
+        table.append($('<tr>').append(heading));
+    };
+
+    // Adds a row for a message, with the same markup as the rows
+    // rendered by the archive's template.
+    var addMessage = function(message) {
+        var row = $('<tr>').attr({
+            id: 'message-' + message.id,
+            'data-date': message.date
+        });
+        $('<td class="time">').text('[' + message.time + ']').appendTo(row);
+        $('<td class="nickname">').text(message.nickname + ':')
+                                  .css({color: message.color})
+                                  .appendTo(row);
+        $('<td class="message">').html(message.message).appendTo(row);
+        table.append(row);
+    };
+
+    var load = function() {
+        var last = table.find('tr[id^="message-"]').last();
+        if (loading || !more || last.length == 0) {
+            return;
+        }
+        loading = true;
+        var date = last.attr('data-date');
+        var after = last.attr('id').split('-')[1];
+        var params = {after: after, date: date};
+        $.getJSON(options.url, params, function(data) {
+            more = data.more;
+            $.each(data.messages, function(i, message) {
+                if (message.date != date) {
+                    date = message.date;
+                    addDay(date);
+                }
+                addMessage(message);
+            });
+            loading = false;
+        }).fail(function() {
+            more = false;
+            loading = false;
+            nextPage.show();
+        });
+    };
+
+    // The next page is loaded by scrolling, so hide its link, which
+    // is kept in case loading fails.
+    var nextPage = $('.pager .next').not('.pager-archive .next').hide();
+
+    $(window).scroll(function() {
+        var win = $(window);
+        if (win.scrollTop() + win.height() >= $(document).height() - 200) {
+            load();
+        }
+    });
+
+};
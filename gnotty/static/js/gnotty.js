@@ -11,22 +11,46 @@ that should include the following members:
     - ircHost:      IRC host to connect to.
     - ircPort:      IRC port to connect to.
     - ircChannel:   IRC channel to join.
-    - ircNickname:  IRC nickname.
+    - ircNickname:  IRC nickname (optional). If omitted, the client
+                    spectates the channel read-only, via a connection
+                    to the IRC server shared with other spectators.
     - ircPassword:  IRC password (optional).
+    - ircSession:   Session token of a previous connection to resume
+                    (optional).
 
 The follwing methods are implemented:
 
+    - start(nickname, password):    Stop spectating and join the channel
+                                    with the given nickname.
     - message(message):         Sends a message string to the channel
     - leave():                  Disconnect from the channel
+    - onSession(token):         Called with the session token, which can be
+                                passed as the ircSession option to resume
+                                the IRC connection after the page reloads.
     - onJoin():                 Called when the client has joined the channel
     - onInvalid():              Called if the nickname used is invalid, eg:
                                 too long, or contains invalid characters.
-    - onNickNames(nicknames):   Called each time someone joins or leaves the
-                                channel, nicknames is an unsorted array of
-                                strings.
+    - onNicknames(nicknames):   Called with the entire list of nicknames
+                                when first joining, nicknames is a sorted
+                                array of objects with nickname and color
+                                members. If onNickAdd and onNickRemove
+                                aren't implemented, also called with the
+                                updated list each time it changes.
+    - onNickAdd(nick, index):   Called when someone joins the channel, nick
+                                is an object with nickname and color
+                                members, and index is its position in the
+                                sorted list.
+    - onNickRemove(nickname, index):    Called when someone leaves the
+                                        channel, with the nickname's
+                                        position in the sorted list.
+                                        Changing nickname calls
+                                        onNickRemove then onNickAdd.
     - onMessage(message):       Called when a message is received from the
                                 channel, message is an object with nickname
                                 and message string members.
+    - onSkipped(count):         Called when the server had to skip messages
+                                because they were arriving faster than the
+                                connection could receive them.
     - onLeave():                Called when client.leave() has completed
 
 */
@@ -38,17 +62,43 @@ var IRCClient = function(options) {
     }
 
     var host = options.httpHost == '0.0.0.0' ? '' : options.httpHost;
-    self.socket = io.connect(host + ':' + options.httpPort, {
+    var connectOptions = {
         transports: ['websocket', 'htmlfile', 'xhr-multipart',
                      'xhr-polling', 'jsonp-polling']
-    });
+    };
+    // The session token is sent with the handshake, so that when the
+    // server runs several worker processes, the handshake reaches the
+    // worker holding the session.
+    if (options.ircSession) {
+        connectOptions.query = 'session=' + options.ircSession;
+    }
+    self.socket = io.connect(host + ':' + options.httpPort, connectOptions);
+
+    var start = function() {
+        self.socket.emit('start', self.ircHost, self.ircPort,
+                                  self.ircChannel, self.ircNickname,
+                                  self.ircPassword, self.ircSession);
+    };
+
+    self.start = function(nickname, password) {
+        self.ircNickname = nickname;
+        self.ircPassword = password;
+        // If we're not connected yet, we'll start once we are.
+        if (self.socket.socket.connected) {
+            start();
+        }
+    };
 
     self.message = function(message) {
         self.socket.emit('message', message);
     };
 
     self.leave = function() {
-        self.socket.disconnect();
+        // Let the server know we're leaving for good, so that it
+        // doesn't keep the session around to be resumed.
+        self.socket.emit('leave', function() {
+            self.socket.disconnect();
+        });
         if (self.onLeave) {
             var interval = setInterval(function() {
                 if (!self.socket.socket.connected) {
@@ -60,9 +110,28 @@ var IRCClient = function(options) {
     };
 
     self.socket.on('connect', function() {
-        self.socket.emit('start', options.ircHost, options.ircPort,
-                                  options.ircChannel, options.ircNickname,
-                                  options.ircPassword);
+        if (self.ircNickname) {
+            start();
+        } else {
+            self.socket.emit('spectate', self.ircHost, self.ircPort,
+                                         self.ircChannel);
+        }
+    });
+
+    // Events sent together by the server - dispatch each of them to
+    // its handler below.
+    self.socket.on('batch', function(events) {
+        for (var i = 0; i < events.length; i++) {
+            self.socket.$emit.apply(self.socket, events[i]);
+        }
+    });
+
+    self.socket.on('session', function(token) {
+        self.ircSession = token;
+        self.socket.socket.options.query = 'session=' + token;
+        if (self.onSession) {
+            self.onSession(token);
+        }
     });
 
     self.socket.on('join', function() {
@@ -80,12 +149,87 @@ var IRCClient = function(options) {
         }
     });
 
+    // Sorted list of nicknames in the channel. The entire list is
+    // only sent when first joining, after which individual changes
+    // are sent, and applied to the list here.
+    self.nicknames = [];
+
+    // Position of the nickname in the sorted list, or where it would
+    // be inserted if it isn't in the list.
+    var nicknameIndex = function(nickname) {
+        var low = 0;
+        var high = self.nicknames.length;
+        while (low < high) {
+            var middle = Math.floor((low + high) / 2);
+            if (self.nicknames[middle].nickname < nickname) {
+                low = middle + 1;
+            } else {
+                high = middle;
+            }
+        }
+        return low;
+    };
+
+    var nicknamesChanged = function() {
+        if (!(self.onNickAdd && self.onNickRemove) && self.onNicknames) {
+            self.onNicknames(self.nicknames);
+        }
+    };
+
+    var addNickname = function(nickname, color) {
+        var index = nicknameIndex(nickname);
+        var nick = self.nicknames[index];
+        if (nick && nick.nickname == nickname) {
+            return;
+        }
+        nick = {nickname: nickname, color: color};
+        self.nicknames.splice(index, 0, nick);
+        if (self.onNickAdd) {
+            self.onNickAdd(nick, index);
+        }
+    };
+
+    var removeNickname = function(nickname) {
+        var index = nicknameIndex(nickname);
+        var nick = self.nicknames[index];
+        if (!nick || nick.nickname != nickname) {
+            return;
+        }
+        self.nicknames.splice(index, 1);
+        if (self.onNickRemove) {
+            self.onNickRemove(nickname, index);
+        }
+    };
+
     self.socket.on('nicknames', function(nicknames) {
+        self.nicknames = nicknames;
         if (self.onNicknames) {
             self.onNicknames(nicknames);
         }
     });
 
+    self.socket.on('nick_add', function(nickname, color) {
+        addNickname(nickname, color);
+        nicknamesChanged();
+    });
+
+    self.socket.on('nick_remove', function(nickname) {
+        removeNickname(nickname);
+        nicknamesChanged();
+    });
+
+    self.socket.on('nick_rename', function(oldNickname, nickname, color) {
+        removeNickname(oldNickname);
+        addNickname(nickname, color);
+        nicknamesChanged();
+    });
+
+    self.socket.on('skipped', function(count) {
+        if (self.onSkipped) {
+            self.onSkipped(count);
+        }
+    });
+
     self.socket.on('message', function(nickname, message, color) {
         if (self.onMessage) {
             self.onMessage({
@@ -106,15 +250,83 @@ var gnotty = function(options) {
     var unread = 0;
     var title = $('title').text();
 
+    // Resume a previous session if there is one, unless there's a
+    // nickname in the querystring.
+    var storage = window.sessionStorage;
+    var storageKey = 'gnotty-session';
+    var parts = location.href.split('?nickname=');
+    var session = storage ? storage.getItem(storageKey) : null;
+    if (session && parts.length != 2) {
+        session = JSON.parse(session);
+        options.ircSession = session.token;
+    }
+
+    // Spectate the channel until a nickname is entered, so that
+    // messages are shown before joining.
+    var client = new IRCClient(options);
+    $('#messages').fadeIn();
+
+    // When Django is used, show the latest messages from the archive,
+    // and load earlier messages when the top of the page is scrolled
+    // to, via the JSON messages API given by the historyUrl option.
+    if (options.historyUrl) {
+        var oldest = null;
+        var oldestDate = null;
+        var loadingHistory = false;
+        var moreHistory = true;
+        var loadHistory = function() {
+            if (loadingHistory || !moreHistory) {
+                return;
+            }
+            loadingHistory = true;
+            // The date lets earlier messages be found once the
+            // oldest message's day has been archived.
+            var params = oldest ? {before: oldest, date: oldestDate} : {};
+            $.getJSON(options.historyUrl, params, function(data) {
+                moreHistory = data.more;
+                if (data.messages.length > 0) {
+                    oldest = data.messages[0].id;
+                    oldestDate = data.messages[0].date;
+                }
+                // Keep the scroll position at the same message once
+                // earlier messages are added above it, or scroll to
+                // the bottom for the first messages loaded.
+                var doc = $(window.document);
+                var height = doc.height();
+                var first = params.before === undefined;
+                $('#messages').prepend($('#messages-template')
+                                       .tmpl(data.messages));
+                window.scrollBy(0, first ? 10000 : doc.height() - height);
+                loadingHistory = false;
+            }).fail(function() {
+                moreHistory = false;
+                loadingHistory = false;
+            });
+        };
+        loadHistory();
+        $(window).scroll(function() {
+            if ($(window).scrollTop() < 50) {
+                loadHistory();
+            }
+        });
+    }
+
+    // Remember the session token, so that the IRC connection can be
+    // resumed if the page is reloaded.
+    client.onSession = function(token) {
+        if (storage) {
+            var session = {token: token, nickname: client.ircNickname};
+            storage.setItem(storageKey, JSON.stringify(session));
+        }
+    };
+
     // Main setup function called when nickname is entered.
-    // Creates IRC client and sets up event handlers.
+    // Joins the channel and sets up event handlers.
     var start = function(nickname, password) {
 
         // Start the IRC client.
         joining = true;
-        options.ircNickname = nickname;
-        options.ircPassword = password;
-        client = new IRCClient(options);
+        client.start(nickname, password);
 
         // Set up the loading animation.
         $('.loading').modal({backdrop: 'static'}).css({opacity: 0.7});
@@ -126,6 +338,9 @@ var gnotty = function(options) {
         // Fade the page out and reload it whenever we're finished,
         // such as an error occurring, or explicitly leaving.
         client.onLeave = function() {
+            if (storage) {
+                storage.removeItem(storageKey);
+            }
             $('body').fadeOut('fast', function() {
                 location = location.href.split('?')[0];
             });
@@ -170,6 +385,10 @@ var gnotty = function(options) {
 
         // On join, finish the progress animation.
         client.onJoin = function() {
+            if (!joining) {
+                // Resumed session after the connection dropped.
+                return;
+            }
             joining = false;
             bar.stop().animate({width: width}, 500);
             clearTimeout(timeout);
@@ -181,52 +400,78 @@ var gnotty = function(options) {
             }, 100);
         };
 
-        // Render the nickanmes list each time we receive it,
-        // which is each time someone joins or leaves.
+        // Render the entire nicknames list when we first join.
         client.onNicknames = function(nicknames) {
             var data = {nicknames: nicknames};
             $('#nicknames').html($('#nicknames-template').tmpl(data));
         };
 
-        // Message received handler.
-        client.onMessage = function(data) {
-
-            if ((data.message == 'joins' || data.message == 'leaves')
-                && !showJoinsAndLeaves()) {
-                return;
+        // Patch the rendered nicknames list as people join and leave,
+        // rather than rendering it again.
+        client.onNickAdd = function(nick, index) {
+            var item = $('#nickname-template').tmpl(nick);
+            var items = $('#nicknames .nickname');
+            if (index < items.length) {
+                item.insertBefore(items.eq(index));
+            } else {
+                item.appendTo('#nicknames ul');
             }
+        };
 
-            // Add a timestamp to each message as we receive it, and
-            // add it to the messages display.
-            var d = new Date();
-            var parts = [d.getHours(), d.getMinutes(), d.getSeconds()];
-            data.time = $.map(parts, function(s) {
-                return (String(s).length == 1 ? '0' : '') + s;
-            }).join(':')
-
-            data.message = urlize($('<div>').text(data.message).html());
-
-            // Auto-scroll the window if we're at the bottom of the
-            // messages list. We need to calculate it before we add
-            // actual message to the list.
-            var win = $(window);
-            var doc = $(window.document);
-            var bottom = win.scrollTop() + win.height() >= doc.height();
-            $('#messages-template').tmpl(data).appendTo('#messages');
-            if (bottom) {
-                window.scrollBy(0, 10000);
-            }
+        client.onNickRemove = function(nickname, index) {
+            $('#nicknames .nickname').eq(index).remove();
+        };
 
-            // Add the number of unread messages to the title if the
-            // page isn't focused.
-            if (!focused) {
-                unread += 1;
-                var s = (unread == 1 ? '' : 's');
-                $('title').text('(' + unread + ' message' + s + ') ' + title);
-            }
+    };
 
-        };
+    // Message received handler.
+    client.onMessage = function(data) {
 
+        if ((data.message == 'joins' || data.message == 'leaves')
+            && !showJoinsAndLeaves()) {
+            return;
+        }
+
+        // Add a timestamp to each message as we receive it, and
+        // add it to the messages display.
+        var d = new Date();
+        var parts = [d.getHours(), d.getMinutes(), d.getSeconds()];
+        data.time = $.map(parts, function(s) {
+            return (String(s).length == 1 ? '0' : '') + s;
+        }).join(':')
+
+        data.message = urlize($('<div>').text(data.message).html());
+
+        // Auto-scroll the window if we're at the bottom of the
+        // messages list. We need to calculate it before we add
+        // actual message to the list.
+        var win = $(window);
+        var doc = $(window.document);
+        var bottom = win.scrollTop() + win.height() >= doc.height();
+        $('#messages-template').tmpl(data).appendTo('#messages');
+        if (bottom) {
+            window.scrollBy(0, 10000);
+        }
+
+        // Add the number of unread messages to the title if the
+        // page isn't focused.
+        if (!focused) {
+            unread += 1;
+            var s = (unread == 1 ? '' : 's');
+            $('title').text('(' + unread + ' message' + s + ') ' + title);
+        }
+
+    };
+
+    // Messages skipped by the server since the connection was too
+    // slow to keep up.
+    client.onSkipped = function(count) {
+        var s = (count == 1 ? '' : 's');
+        client.onMessage({
+            nickname: '*',
+            message: count + ' message' + s + ' skipped',
+            color: '#999'
+        });
     };
 
     // Main submit handler - if there are still hidden elements,
@@ -257,9 +502,11 @@ var gnotty = function(options) {
     });
 
     // Join if there's a nickname in the querystring.
-    var parts = location.href.split('?nickname=');
+    // Otherwise resume a previous session if there is one.
     if (parts.length == 2) {
         start(parts[1].split('&')[0]);
+    } else if (session) {
+        start(session.nickname);
     }
 
     // When the window loses focus, reset the unread messages count.
@@ -3,7 +3,7 @@ from django import template
 from django.conf import settings as django_settings
 from django.db.models import Min, Max
 
-from gnotty.models import IRCMessage
+from gnotty.models import DailyActivity
 from gnotty.conf import settings
 
 
@@ -12,11 +12,10 @@ register = template.Library()
 
 @register.inclusion_tag("gnotty/includes/nav.html", takes_context=True)
 def gnotty_nav(context):
-    min_max = IRCMessage.objects.aggregate(Min("message_time"),
-                                           Max("message_time"))
+    min_max = DailyActivity.objects.aggregate(Min("day"), Max("day"))
     if min_max.values()[0]:
-        years = range(min_max["message_time__max"].year,
-                      min_max["message_time__min"].year - 1, -1)
+        years = range(min_max["day__max"].year,
+                      min_max["day__min"].year - 1, -1)
     else:
         years = []
     context["IRC_CHANNEL"] = settings.IRC_CHANNEL
@@ -0,0 +1,145 @@
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from datetime import date, timedelta
+from re import search
+from threading import Thread
+from unittest import skipUnless
+
+from django.db import connection
+from django.test import TestCase
+from django.utils.timezone import now
+
+from gnotty.bots.rss import RSSMixin, parse
+from gnotty.models import IRCMessage
+from gnotty.views import date_range
+
+
+class MessageIndexTests(TestCase):
+    """
+    Checks that the queries for a day of messages are answered by the
+    indexes on message time, rather than scanning the whole table.
+    """
+
+    def setUp(self):
+        start = now() - timedelta(days=10)
+        for i in range(240):
+            IRCMessage.objects.create(nickname="nickname%s" % (i % 5),
+                                      message="message %s" % i,
+                                      server="localhost", channel="#gnotty",
+                                      join_or_leave=i % 10 == 0,
+                                      message_time=start + timedelta(hours=i))
+
+    def query_plan(self, messages):
+        sql, params = messages.query.sql_with_params()
+        cursor = connection.cursor()
+        cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+        return "\n".join([row[-1] for row in cursor.fetchall()])
+
+    def day_messages(self):
+        day = date.today() - timedelta(days=5)
+        messages = IRCMessage.objects.filter(**date_range(day, day +
+                                                          timedelta(days=1)))
+        return messages.order_by("message_time", "id")
+
+    @skipUnless(connection.vendor == "sqlite", "Checks SQLite query plans")
+    def test_day_uses_message_time_index(self):
+        plan = self.query_plan(self.day_messages())
+        self.assertTrue(search(r"USING (COVERING )?INDEX \S+ "
+                               r"\(message_time>", plan), plan)
+
+    @skipUnless(connection.vendor == "sqlite", "Checks SQLite query plans")
+    def test_day_without_joins_uses_join_or_leave_index(self):
+        messages = self.day_messages().filter(join_or_leave=False)
+        plan = self.query_plan(messages)
+        self.assertTrue(search(r"USING (COVERING )?INDEX \S+ "
+                               r"\(join_or_leave=\? AND message_time", plan),
+                        plan)
+
+
+FEED = """<?xml version="1.0"?>
+<rss version="2.0"><channel><title>Gnotty</title>%s</channel></rss>"""
+
+FEED_ITEM = "<item><title>%s</title><link>http://example.com/%s</link></item>"
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    """
+    Serves a feed with an item for each of the server's ``items``,
+    which have links but no IDs, with the server's ``status``.
+    """
+
+    def do_GET(self):
+        items = "".join([FEED_ITEM % (i, i) for i in self.server.items])
+        self.send_response(self.server.status)
+        self.send_header("Content-Type", "application/rss+xml")
+        self.end_headers()
+        self.wfile.write(FEED % items)
+
+    def log_message(self, *args):
+        pass
+
+
+class FeedBot(RSSMixin):
+
+    def __init__(self, *args, **kwargs):
+        self.posted = []
+        super(FeedBot, self).__init__(*args, **kwargs)
+
+    def message_channel(self, message, priority=None):
+        self.posted.append(message)
+
+
+class RSSTests(TestCase):
+    """
+    Reads feeds from a local HTTP server standing in for a real feed.
+    """
+
+    def setUp(self):
+        self.server = HTTPServer(("127.0.0.1", 0), FeedHandler)
+        self.server.items = ["first"]
+        self.server.status = 200
+        thread = Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = "http://127.0.0.1:%s/" % self.server.server_port
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @skipUnless(parse, "Requires feedparser")
+    def test_items_without_ids(self):
+        bot = FeedBot(feeds=[self.url])
+        self.assertEqual(bot.parse_feed(self.url), [])
+        self.server.items.append("second")
+        self.assertEqual(bot.parse_feed(self.url),
+                         ["second: http://example.com/second (via Gnotty)"])
+        self.assertEqual(bot.parse_feed(self.url), [])
+
+    @skipUnless(parse, "Requires feedparser")
+    def test_failed_fetch_doesnt_prime(self):
+        unreachable = "http://127.0.0.1:1/"
+        bot = FeedBot(feeds=[self.url, unreachable])
+        self.server.status = 500
+        bot.parse_feeds()
+        self.assertFalse(bot.feed_state[self.url].get("primed"))
+        self.assertFalse(bot.feed_state[unreachable].get("primed"))
+        self.server.status = 200
+        self.server.items.append("second")
+        bot.parse_feeds()
+        self.assertEqual(bot.posted, [])
+        self.server.items.append("third")
+        bot.parse_feeds()
+        self.assertEqual(bot.posted,
+                         ["third: http://example.com/third (via Gnotty)"])
+
+    @skipUnless(parse, "Requires feedparser")
+    def test_backlog_is_capped(self):
+        bot = FeedBot(feeds=[self.url], feed_batch_size=1,
+                      feed_backlog_size=2)
+        bot.parse_feeds()
+        self.assertEqual(bot.posted, [])
+        self.server.items.extend(["a", "b", "c"])
+        bot.parse_feeds()
+        self.assertEqual(bot.posted, ["b: http://example.com/b (via Gnotty)"])
+        self.assertEqual(len(bot.feed_backlog), 1)
@@ -10,6 +10,8 @@ day_pattern     = month_pattern   + "(?P<day>\d{1,2})/"
 urlpatterns = patterns("gnotty.views",
     url("^$", "chat", name="gnotty_chat"),
     url(archive_pattern + "$", "messages", name="gnotty_search"),
+    url(archive_pattern + "messages.json$", "messages_json",
+        name="gnotty_messages_json"),
     url(year_pattern    + "$", "calendar", name="gnotty_year"),
     url(month_pattern   + "$", "calendar", name="gnotty_month"),
     url(day_pattern     + "$", "messages", name="gnotty_day"),
@@ -1,59 +1,499 @@
 
 from calendar import Calendar, SUNDAY
+from collections import deque
 from datetime import datetime, date, timedelta
+from hashlib import md5
+from itertools import islice
+from json import dumps
+from uuid import uuid4
 
+from django.conf import settings as django_settings
 from django.contrib import auth
 from django.contrib.auth.decorators import login_required
 from django.contrib.messages import info, error
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
-from django.db.models import Q
+from django.db.models import F, Q
+from django.http import Http404, HttpResponse, HttpResponseNotModified
 from django.shortcuts import render, redirect
+from django.template.loader import render_to_string
+from django.utils.timezone import get_current_timezone, is_aware
+from django.utils.timezone import localtime, make_aware, now
+try:
+    from django.http import StreamingHttpResponse
+except ImportError:
+    # Django < 1.5 streams any iterator given to HttpResponse.
+    from django.http import HttpResponse as StreamingHttpResponse
 
-from gnotty.models import IRCMessage
+from gnotty.archive import archived_channels, read_day
+from gnotty.models import DailyActivity, IRCMessage, message_day
 from gnotty.conf import settings
+from gnotty.search import can_rank, search
+
+
+# Seconds that pages for past days are cached by browsers for, after
+# which they're revalidated with their ETag, so that pages changed by
+# the gnotty_import, gnotty_render and gnotty_archive commands are
+# eventually picked up.
+CLOSED_DAY_MAX_AGE = 60 * 60
+
+# Seconds that pages for past days, and the version of all cached
+# pages, are kept in the cache for. Given explicitly, as a timeout of
+# None only means no expiry from Django 1.6, and memcached treats
+# timeouts over 30 days as timestamps.
+CLOSED_DAY_TIMEOUT = 30 * 24 * 60 * 60
+
+# Time after the end of a day that messages may still be written for
+# it, after which the day's page is cached for a long time.
+CLOSED_DAY_DELAY = timedelta(minutes=5)
 
 
 def hide_joins_and_leaves(request):
     return request.COOKIES.get("gnotty-hide-joins-leaves", "") == "1"
 
 
+def date_range(start, end):
+    """
+    Returns lookups for messages from the start date up to, but not
+    including, the end date. Unlike the ``__year``, ``__month`` and
+    ``__day`` lookups, these can use the ``message_time`` indexes.
+    """
+    times = [datetime.combine(d, datetime.min.time()) for d in (start, end)]
+    if django_settings.USE_TZ:
+        times = [make_aware(t, get_current_timezone()) for t in times]
+    return {"message_time__gte": times[0], "message_time__lt": times[1]}
+
+
 def chat(request, template="gnotty/chat.html"):
     context = dict(settings)
+    context["HISTORY_URL"] = reverse("gnotty_messages_json")
     return render(request, template, context)
 
 
+def from_cursor(messages, cursor, later, inclusive=False):
+    """
+    Filters messages to those after or before the message with the
+    given ID, by message time and then ID.
+    """
+    try:
+        times = IRCMessage.objects.filter(id=int(cursor))
+        time = times.values_list("message_time", flat=True)[0]
+    except (ValueError, IndexError):
+        raise Http404
+    op = "gt" if later else "lt"
+    id_op = op + "e" if inclusive else op
+    return messages.filter(Q(**{"message_time__" + op: time}) |
+                           Q(message_time=time, **{"id__" + id_op: cursor}))
+
+
+def paginate(request, messages, descending=False):
+    """
+    Returns a page of messages ordered by message time and then ID,
+    along with the URLs for the previous and next pages. Pages are
+    requested with the ID of the last message on the previous page
+    (``after``), or the first message on the next page (``before``),
+    so each page is a single indexed range query regardless of how
+    far into the results it is. The ``id`` param used to highlight a
+    message starts the page from that message.
+    """
+    size = settings.PAGE_SIZE
+    order = ("message_time", "id")
+    reverse_order = ("-message_time", "-id")
+    if descending:
+        order, reverse_order = reverse_order, order
+    after = request.GET.get("after")
+    before = request.GET.get("before")
+    start = request.GET.get("id")
+    has_prev = has_next = False
+    if after:
+        page = from_cursor(messages, after, not descending)
+        page = list(page.order_by(*order)[:size + 1])
+        has_prev = True
+        has_next = len(page) > size
+        page = page[:size]
+    elif before:
+        page = from_cursor(messages, before, descending)
+        page = list(page.order_by(*reverse_order)[:size + 1])
+        has_prev = len(page) > size
+        has_next = True
+        page = page[:size][::-1]
+    elif start:
+        page = from_cursor(messages, start, not descending, inclusive=True)
+        page = list(page.order_by(*order)[:size + 1])
+        has_prev = from_cursor(messages, start, descending).exists()
+        has_next = len(page) > size
+        page = page[:size]
+    else:
+        page = list(messages.order_by(*order)[:size + 1])
+        has_next = len(page) > size
+        page = page[:size]
+    return (page,) + page_urls(request, page, has_prev, has_next)
+
+
+def paginate_segment(request, messages):
+    """
+    Same as ``paginate``, but for the messages read in order from an
+    archived day's segment, reading only as far as the page.
+    """
+    size = settings.PAGE_SIZE
+    after = request.GET.get("after")
+    before = request.GET.get("before")
+    start = request.GET.get("id")
+    has_prev = has_next = False
+    page = []
+    if before:
+        page = deque(maxlen=size + 1)
+        for message in messages:
+            if str(message.id) == before:
+                has_next = True
+                break
+            page.append(message)
+        page = list(page)
+        has_prev = len(page) > size
+        page = page[-size:]
+    else:
+        for message in messages:
+            if after:
+                has_prev = True
+                if str(message.id) == after:
+                    after = None
+                continue
+            if start:
+                if str(message.id) != start:
+                    has_prev = True
+                    continue
+                start = None
+            page.append(message)
+            if len(page) > size:
+                has_next = True
+                page = page[:size]
+                break
+    return (page,) + page_urls(request, page, has_prev, has_next)
+
+
+def page_urls(request, page, has_prev, has_next):
+    """
+    URLs for the pages before and after the given page of messages.
+    """
+    prev_page_url, next_page_url = None, None
+    querystring = request.GET.copy()
+    for param in ("after", "before", "id"):
+        querystring.pop(param, None)
+    if has_prev and page:
+        querystring["before"] = page[0].id
+        prev_page_url = "?" + querystring.urlencode()
+        del querystring["before"]
+    if has_next and page:
+        querystring["after"] = page[-1].id
+        next_page_url = "?" + querystring.urlencode()
+    return prev_page_url, next_page_url
+
+
+def stream(request, template, context, rows_template, rows_context):
+    """
+    Renders the template in parts, so that the top of the page is
+    sent while the rows of messages are rendered, in chunks of
+    ``rows_template``. The template renders the ``rows`` variable
+    where the rows go.
+    """
+    marker = "GNOTTY_ROWS_%s" % uuid4().hex
+    context["rows"] = marker
+    html = render(request, template, context).content
+    head, tail = html.split(marker, 1)
+    yield head
+    messages = rows_context["messages"]
+    chunk_size = 100
+    for i in range(0, len(messages), chunk_size):
+        rows_context["messages"] = messages[i:i + chunk_size]
+        yield render_to_string(rows_template, rows_context).encode("utf-8")
+    yield tail
+
+
+def day_cache_key(request, day):
+    """
+    Cache key for a day's page, which varies by everything the page
+    depends on besides the messages themselves. Includes a version
+    that ``clear_day_cache`` changes.
+    """
+    version = cache.get("gnotty-day-version")
+    if version is None:
+        # A new version rather than a default one, so that pages
+        # cached before the version expired aren't served again.
+        cache.add("gnotty-day-version", uuid4().hex, CLOSED_DAY_TIMEOUT)
+        version = cache.get("gnotty-day-version")
+    params = [request.GET.get(name) for name in ("after", "before", "id")]
+    key = (version, settings.IRC_CHANNEL, day, hide_joins_and_leaves(request),
+           params, request.user.is_authenticated())
+    return "gnotty-day-%s" % md5(repr(key)).hexdigest()
+
+
+def clear_day_cache():
+    """
+    Invalidates all cached day pages. Called when the messages for
+    past days are changed.
+    """
+    cache.set("gnotty-day-version", uuid4().hex, CLOSED_DAY_TIMEOUT)
+
+
+def day_response(request, content, etag, max_age):
+    """
+    Response for a cached day page, or a 304 if the browser already
+    has it.
+    """
+    if request.META.get("HTTP_IF_NONE_MATCH") == etag:
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(content)
+    cache_control = "private" if settings.LOGIN_REQUIRED else "public"
+    response["Cache-Control"] = "%s, max-age=%s" % (cache_control, max_age)
+    response["ETag"] = etag
+    response["Vary"] = "Cookie"
+    return response
+
+
 def messages(request, year=None, month=None, day=None,
-             template="gnotty/messages.html"):
+             template="gnotty/messages.html",
+             rows_template="gnotty/includes/messages.html"):
     """
-    Show messages for the given query or day.
+    Show messages for the given query or day, a page at a time.
     """
 
     query = request.REQUEST.get("q")
     prev_url, next_url = None, None
+    cache_key = None
+    segment = None
     messages = IRCMessage.objects.all()
+    descending = False
     if hide_joins_and_leaves(request):
         messages = messages.filter(join_or_leave=False)
     if query:
-        search = Q(message__icontains=query) | Q(nickname__icontains=query)
-        messages = messages.filter(search).order_by("-message_time")
+        descending = True
+        # Without a full-text index, results are paged by time
+        # instead, since they can't be ranked.
+        rank = request.REQUEST.get("order") == "rank" and can_rank()
+        messages = search(messages, query, rank)
     elif year and month and day:
-        messages = messages.filter(message_time__year=year,
-                                   message_time__month=month,
-                                   message_time__day=day)
         day_delta = timedelta(days=1)
-        this_date = date(int(year), int(month), int(day))
+        try:
+            this_date = date(int(year), int(month), int(day))
+        except ValueError:
+            raise Http404
         prev_date = this_date - day_delta
         next_date = this_date + day_delta
+        day_range = date_range(this_date, next_date)
+        messages = messages.filter(**day_range)
+        # Pages for past days only change when clear_day_cache is
+        # called, so they're cached for a long time, and the current
+        # day is cached briefly.
+        closed = now() > day_range["message_time__lt"] + CLOSED_DAY_DELAY
+        if closed:
+            timeout, max_age = CLOSED_DAY_TIMEOUT, CLOSED_DAY_MAX_AGE
+        else:
+            timeout = max_age = settings.DAY_CACHE_TTL
+        cache_key = day_cache_key(request, this_date)
+        cached = cache.get(cache_key)
+        if cached:
+            return day_response(request, *cached)
+        # Old days may have been moved out of the database by the
+        # gnotty_archive command.
+        if closed and archived_channels(this_date):
+            segment = read_day(this_date)
+            if hide_joins_and_leaves(request):
+                segment = (m for m in segment if not m.join_or_leave)
         prev_url = reverse("gnotty_day", args=prev_date.timetuple()[:3])
         next_url = reverse("gnotty_day", args=next_date.timetuple()[:3])
     else:
         return redirect("gnotty_year", year=datetime.now().year)
 
+    if query and rank:
+        # Ranked results can't be paged by time, so only the best
+        # matches are shown.
+        prev_page_url, next_page_url = None, None
+        messages = list(messages[:settings.PAGE_SIZE])
+    elif segment is not None:
+        messages, prev_page_url, next_page_url = paginate_segment(request,
+                                                                  segment)
+    else:
+        messages, prev_page_url, next_page_url = paginate(request, messages,
+                                                          descending)
+    last_day = None
+    for message in messages:
+        day = message.message_time.date()
+        message.new_day = day != last_day
+        last_day = day
+
     context = dict(settings)
     context["messages"] = messages
     context["prev_url"] = prev_url
     context["next_url"] = next_url
-    return render(request, template, context)
+    context["prev_page_url"] = prev_page_url
+    context["next_page_url"] = next_page_url
+    rows_context = {
+        "messages": messages,
+        "query": query,
+        "prev_url": prev_url,
+        "next_url": next_url,
+    }
+    content = stream(request, template, context, rows_template, rows_context)
+    if cache_key:
+        content = "".join(content)
+        etag = '"%s"' % md5(content).hexdigest()
+        cache.set(cache_key, (content, etag, max_age), timeout)
+        return day_response(request, content, etag, max_age)
+    return StreamingHttpResponse(content)
+
+
+def message_json(message):
+    """
+    Compact representation of a message for ``messages_json``.
+    """
+    message_time = message.message_time
+    if is_aware(message_time):
+        message_time = localtime(message_time)
+    if not message.message_html:
+        message.render()
+    return {
+        "id": message.id,
+        "nickname": message.nickname,
+        "message": message.message_html,
+        "color": message.nickname_color,
+        "date": message_time.strftime("%Y-%m-%d"),
+        "time": message_time.strftime("%H:%M:%S"),
+        "join_or_leave": message.join_or_leave,
+    }
+
+
+def archived_after(messages, day, after, hide_joins, limit):
+    """
+    Yields the messages following the message with the ID ``after``
+    on a day moved out of the database by the gnotty_archive command,
+    continuing through the following archived days, and then from
+    ``messages`` in the database once a day isn't archived, up to
+    ``limit`` messages from the database.
+    """
+    segment = read_day(day)
+    for message in segment:
+        if str(message.id) == after:
+            break
+    else:
+        raise Http404
+    for message in segment:
+        if not (hide_joins and message.join_or_leave):
+            yield message
+    days = DailyActivity.objects.filter(day__gt=day).order_by("day")
+    for day in days.values_list("day", flat=True).distinct().iterator():
+        if not archived_channels(day):
+            start = date_range(day, day)["message_time__gte"]
+            later = messages.filter(message_time__gte=start)
+            for message in later.order_by("message_time", "id")[:limit]:
+                yield message
+            return
+        for message in read_day(day):
+            if not (hide_joins and message.join_or_leave):
+                yield message
+
+
+def archived_before(messages, day, before, hide_joins, limit):
+    """
+    Yields the messages preceding the message with the ID ``before``,
+    latest first, or the latest messages if ``before`` isn't given.
+    Messages are read from the segments of days moved out of the
+    database by the gnotty_archive command, and otherwise from
+    ``messages`` in the database, up to ``limit`` messages at a time.
+    ``day`` is the day of the ``before`` message, if known.
+    """
+    last = None
+    in_database = False
+    if before and day and archived_channels(day):
+        segment = list(read_day(day))
+        ids = [str(message.id) for message in segment]
+        if before not in ids:
+            raise Http404
+        for message in reversed(segment[:ids.index(before)]):
+            if not (hide_joins and message.join_or_leave):
+                yield message
+    else:
+        in_database = True
+        if before:
+            messages = from_cursor(messages, before, False)
+        else:
+            day = None
+        for last in messages.order_by("-message_time", "-id")[:limit]:
+            yield last
+        if last is not None:
+            day = message_day(last.message_time)
+        elif before:
+            message = IRCMessage.objects.get(id=before)
+            day = message_day(message.message_time)
+    days = DailyActivity.objects.order_by("-day")
+    if day:
+        days = days.filter(day__lt=day)
+    for day in days.values_list("day", flat=True).distinct().iterator():
+        if archived_channels(day):
+            for message in reversed(list(read_day(day))):
+                if not (hide_joins and message.join_or_leave):
+                    yield message
+        elif not in_database:
+            # All of the earlier messages in the database are read
+            # at once, after which only archived days are left.
+            in_database = True
+            end = date_range(day, day + timedelta(days=1))["message_time__lt"]
+            earlier = messages.filter(message_time__lt=end)
+            for message in earlier.order_by("-message_time", "-id")[:limit]:
+                yield message
+
+
+def messages_json(request):
+    """
+    Returns messages as JSON, either the latest messages, or those
+    before or after the message with the ID given by the ``before``
+    or ``after`` param, up to ``limit`` messages. Joins and leaves
+    are left out when the ``joins`` param is ``0``, or the cookie
+    for hiding them is set. Messages are ordered by time, and
+    ``more`` is true if there are further messages in the direction
+    requested. The ``date`` param gives the day of the ``after`` or
+    ``before`` message, as YYYY-MM-DD, so that messages around it can
+    be read when the day has been archived. Earlier messages continue
+    into archived days once the database runs out.
+    """
+    try:
+        limit = int(request.GET.get("limit", 100))
+    except ValueError:
+        limit = 100
+    limit = max(1, min(limit, settings.PAGE_SIZE))
+    messages = IRCMessage.objects.all()
+    joins = request.GET.get("joins")
+    hide_joins = joins == "0" or (joins is None and
+                                  hide_joins_and_leaves(request))
+    if hide_joins:
+        messages = messages.filter(join_or_leave=False)
+    after = request.GET.get("after")
+    before = request.GET.get("before")
+    day = request.GET.get("date")
+    if day:
+        try:
+            day = datetime.strptime(day, "%Y-%m-%d").date()
+        except ValueError:
+            raise Http404
+    if after and day and archived_channels(day):
+        page = list(islice(archived_after(messages, day, after, hide_joins,
+                                          limit + 1), limit + 1))
+        more = len(page) > limit
+        page = page[:limit]
+    elif after:
+        messages = from_cursor(messages, after, True)
+        page = list(messages.order_by("message_time", "id")[:limit + 1])
+        more = len(page) > limit
+        page = page[:limit]
+    else:
+        page = list(islice(archived_before(messages, day, before,
+                                           hide_joins, limit + 1),
+                           limit + 1))
+        more = len(page) > limit
+        page = page[:limit][::-1]
+    data = {"messages": map(message_json, page), "more": more}
+    return HttpResponse(dumps(data, separators=(",", ":")),
+                        content_type="application/json")
 
 
 def calendar(request, year=None, month=None, template="gnotty/calendar.html"):
@@ -65,18 +505,18 @@ def calendar(request, year=None, month=None, template="gnotty/calendar.html"):
         year = int(year)
     except TypeError:
         year = datetime.now().year
-    lookup = {"message_time__year": year}
-    if month:
-        lookup["message_time__month"] = month
-    if hide_joins_and_leaves(request):
-        lookup["join_or_leave"] = False
-
-    messages = IRCMessage.objects.filter(**lookup)
     try:
-        dates = messages.datetimes("message_time", "day")
-    except AttributeError:
-        dates = messages.dates("message_time", "day")
-    days = [d.date() for d in dates]
+        if month:
+            start = date(year, int(month), 1)
+            end = date(year + int(month) // 12, int(month) % 12 + 1, 1)
+        else:
+            start, end = date(year, 1, 1), date(year + 1, 1, 1)
+    except ValueError:
+        raise Http404
+    activity = DailyActivity.objects.filter(day__gte=start, day__lt=end)
+    if hide_joins_and_leaves(request):
+        activity = activity.filter(messages__gt=F("joins_leaves"))
+    days = list(activity.values_list("day", flat=True).distinct())
     months = []
 
     if days:
@@ -103,9 +543,10 @@ def calendar(request, year=None, month=None, template="gnotty/calendar.html"):
 
 
 if settings.LOGIN_REQUIRED:
-    chat     = login_required(chat)
-    messages = login_required(messages)
-    calendar = login_required(calendar)
+    chat          = login_required(chat)
+    messages      = login_required(messages)
+    messages_json = login_required(messages_json)
+    calendar      = login_required(calendar)
 
 
 def login(request):